@@ -0,0 +1,98 @@
+"""Runs the bot's folder, upload, link and Telegram paths end to end against local stand-ins.
+
+A FakeGoFileServer answers every GoFile call (the pooled sessions are redirected to it)
+and a FakeTelegramClient takes the place of Telegram, so whole jobs run offline with
+configurable latency and bandwidth on both sides. Each scenario runs --jobs copies of
+one job concurrently through the bot's scheduler and reports end-to-end MB/s, peak RSS,
+event-loop lag and the GoFile API calls it made.
+
+    python benchmarks/bench_end_to_end.py --files 16 --file-size-mb 8 --latency-ms 40 --bandwidth-mb 50 --jobs 3
+"""
+import argparse
+import asyncio
+import os
+import time
+
+# Read by the bot at import time: every run transfers for real instead of answering from the
+# index, and the fake client has no MTProto senders to spread parts over
+os.environ.setdefault("DEDUP_DB_PATH", "")
+os.environ.setdefault("TELEGRAM_TRANSFER_WORKERS", "1")
+
+from common import (FakeEvent, FakeGoFileServer, FakeTelegramClient, LoopLagMonitor, load_bot, make_payload,
+                    peak_rss, reset_peak_rss, route_gofile)
+
+SCENARIOS = ("folder", "upload", "link", "telegram")
+
+
+async def run_scenario(bot, server, telegram, name, args):
+    file_size = int(args.file_size_mb * 1024**2)
+    if name == "folder":
+        url = f"https://gofile.io/d/{server.build_tree(args.files, file_size, args.fan_out)}"
+        events = [FakeEvent(telegram, sender_id=job + 1, text=url) for job in range(args.jobs)]
+        job = lambda event: bot.process_gofile_folder(event, url)
+        moved = lambda: telegram.sent_bytes
+    elif name == "upload":
+        path = os.path.abspath("bench_upload.bin")
+        with open(path, "wb") as f: f.write(make_payload(file_size))
+        events = [FakeEvent(telegram, sender_id=job + 1) for job in range(args.jobs)]
+        async def job(event):
+            status_message = await event.respond("Uploading...")
+            await bot.upload_to_gofile(path, os.path.basename(path), status_message)
+        moved = lambda: server.uploaded_bytes
+    elif name == "link":
+        url = server.file_url(server.add_file("bench_link.bin", file_size))
+        events = [FakeEvent(telegram, sender_id=job + 1, text=url) for job in range(args.jobs)]
+        job = lambda event: bot.upload_from_link(event, url)
+        moved = lambda: server.uploaded_bytes
+    else:
+        events = [FakeEvent(telegram, sender_id=job + 1, media=(f"bench_tg_{job}.bin", file_size)) for job in range(args.jobs)]
+        job = bot.handle_file_upload
+        moved = lambda: server.uploaded_bytes
+
+    server.calls.clear(); server.uploaded_bytes = 0
+    telegram.calls.clear(); telegram.sent_bytes = telegram.received_bytes = 0
+    telegram.messages.clear()
+    reset_peak_rss()
+    async with LoopLagMonitor() as lag:
+        start = time.perf_counter()
+        await asyncio.gather(*(bot.SCHEDULER.submit(event, lambda event=event: job(event)) for event in events))
+        elapsed = time.perf_counter() - start
+        # Final texts go out through the rate-limited status updater; wait for them before checking
+        for _ in range(200):
+            if not bot.STATUS._pending: break
+            await asyncio.sleep(0.05)
+    if name == "upload": os.remove(path)
+
+    failed = sum(message.text.startswith(("❌", "⚠️")) for message in telegram.messages)
+    calls = " ".join(f"{endpoint}={count}" for endpoint, count in sorted(server.calls.items()))
+    nbytes = moved()
+    print(f"{name:>8} {args.jobs:>4} {nbytes / 1024**2:>8.1f} {elapsed:>8.2f} {nbytes / elapsed / 1024**2:>8.1f} "
+          f"{peak_rss() / 1024**2:>8.1f} {lag.max * 1000:>8.1f} {lag.p99 * 1000:>8.1f} {telegram.calls['edit']:>6}  "
+          f"{'ok' if not failed else f'{failed} FAILED'}  {calls}")
+
+
+async def run(args):
+    bot = load_bot()
+    telegram = FakeTelegramClient(bandwidth=int(args.telegram_bandwidth_mb * 1024**2), latency=args.latency_ms / 1000)
+    with FakeGoFileServer(latency=args.latency_ms / 1000, bandwidth=int(args.bandwidth_mb * 1024**2)) as server:
+        route_gofile(bot, server)
+        print(f"{'scenario':>8} {'jobs':>4} {'MB':>8} {'seconds':>8} {'MB/s':>8} {'peak MB':>8} {'lag max':>8} {'lag p99':>8} {'edits':>6}  check  GoFile calls")
+        for name in args.scenarios:
+            await run_scenario(bot, server, telegram, name, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=2, help="copies of each job run concurrently")
+    parser.add_argument("--files", type=int, default=12, help="files in the synthetic folder tree")
+    parser.add_argument("--fan-out", type=int, default=3, help="subfolders per folder in the synthetic tree")
+    parser.add_argument("--file-size-mb", type=float, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20, help="added to every GoFile request and Telegram call")
+    parser.add_argument("--bandwidth-mb", type=float, default=0, help="per-connection GoFile cap in MB/s, 0 for unlimited")
+    parser.add_argument("--telegram-bandwidth-mb", type=float, default=0, help="per-transfer Telegram cap in MB/s, 0 for unlimited")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
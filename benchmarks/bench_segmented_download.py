@@ -0,0 +1,42 @@
+"""Compares single-stream and segmented GoFileDownloader throughput against a local Range server.
+
+    python benchmarks/bench_segmented_download.py --size-mb 256 --bandwidth-mb 20 --connections 1 4 8
+"""
+import argparse
+import hashlib
+import os
+import time
+
+from common import RangeFileServer, load_bot, make_payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--bandwidth-mb", type=float, default=16, help="per-connection cap in MB/s, 0 for unlimited")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    bot = load_bot()
+    payload = make_payload(args.size_mb * 1024**2)
+    expected = hashlib.sha256(payload).hexdigest()
+    bot.SEGMENTED_DOWNLOAD_MIN_SIZE = 0
+
+    with RangeFileServer(payload, bandwidth=int(args.bandwidth_mb * 1024**2)) as server:
+        print(f"{'connections':>11} {'seconds':>8} {'MB/s':>8} {'requests':>8}  sha256")
+        for connections in args.connections:
+            dest = os.path.abspath(f"bench_{connections}.bin")
+            file_obj = bot.GoFileFile(link=server.url, dest=dest, size=len(payload), name=os.path.basename(dest))
+            downloader = bot.GoFileDownloader(token="benchmark", connections=connections)
+            server.requests = 0
+            start = time.perf_counter()
+            ok = downloader.download(file_obj)
+            elapsed = time.perf_counter() - start
+            with open(dest, "rb") as f: digest = hashlib.file_digest(f, "sha256").hexdigest()
+            os.remove(dest)
+            status = "ok" if ok and digest == expected else "MISMATCH"
+            print(f"{connections:>11} {elapsed:>8.2f} {len(payload) / elapsed / 1024**2:>8.1f} {server.requests:>8}  {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Measures ParallelTransferrer throughput against a fake MTProto part server.
+
+Each fake sender serves one request at a time with a fixed round-trip latency and a
+per-connection bandwidth cap, which is what bounds Telegram's own single-connection
+transfers. workers=1 is the sequential baseline.
+
+    python benchmarks/bench_telegram_transfer.py --size-mb 64 --latency-ms 80 --bandwidth-mb 4 --workers 1 4 8
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+import types
+
+from common import load_bot, make_payload
+
+
+class FakePartServer:
+    """Stores one payload for GetFile and collects parts sent with SaveFilePart/SaveBigFilePart."""
+    def __init__(self, bot, payload: bytes, latency: float, bandwidth: int):
+        self.bot, self.payload, self.latency, self.bandwidth = bot, payload, latency, bandwidth
+        self.uploaded = {}
+        self.requests = 0
+
+    def sender(self):
+        return FakeSender(self)
+
+    def assembled_upload(self) -> bytes:
+        return b"".join(self.uploaded[index] for index in sorted(self.uploaded))
+
+
+class FakeSender:
+    def __init__(self, server: FakePartServer):
+        self.server = server
+        self._lock = asyncio.Lock()
+
+    async def send(self, request):
+        bot, server = self.server.bot, self.server
+        async with self._lock:
+            server.requests += 1
+            if isinstance(request, bot.GetFileRequest):
+                data = server.payload[request.offset:request.offset + request.limit]
+                result = types.SimpleNamespace(bytes=data)
+            elif isinstance(request, (bot.SaveFilePartRequest, bot.SaveBigFilePartRequest)):
+                data = request.bytes
+                server.uploaded[request.file_part] = data
+                result = True
+            else:
+                raise TypeError(f"fake part server cannot answer {type(request).__name__}")
+            await asyncio.sleep(server.latency + (len(data) / server.bandwidth if server.bandwidth else 0))
+            return result
+
+    async def disconnect(self):
+        pass
+
+
+async def run(args):
+    bot = load_bot()
+    payload = make_payload(args.size_mb * 1024**2)
+    expected = hashlib.sha256(payload).hexdigest()
+    path = os.path.abspath("upload.bin")
+    with open(path, "wb") as f: f.write(payload)
+
+    print(f"{'direction':>9} {'workers':>7} {'seconds':>8} {'MB/s':>8} {'requests':>8}  check")
+    for workers in args.workers:
+        server = FakePartServer(bot, payload, args.latency_ms / 1000, int(args.bandwidth_mb * 1024**2))
+        transferrer = bot.ParallelTransferrer(client=None, dc_id=1, workers=workers, sender_factory=lambda: asyncio.sleep(0, server.sender()))
+
+        start = time.perf_counter()
+        hasher = hashlib.sha256()
+        async for chunk in transferrer.download(location=None, file_size=len(payload)): hasher.update(chunk)
+        elapsed = time.perf_counter() - start
+        check = "ok" if hasher.hexdigest() == expected else "MISMATCH"
+        print(f"{'download':>9} {workers:>7} {elapsed:>8.2f} {len(payload) / elapsed / 1024**2:>8.1f} {server.requests:>8}  {check}")
+
+        server.requests = 0
+        start = time.perf_counter()
+        await transferrer.upload(path)
+        elapsed = time.perf_counter() - start
+        check = "ok" if hashlib.sha256(server.assembled_upload()).hexdigest() == expected else "MISMATCH"
+        print(f"{'upload':>9} {workers:>7} {elapsed:>8.2f} {len(payload) / elapsed / 1024**2:>8.1f} {server.requests:>8}  {check}")
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--bandwidth-mb", type=float, default=4, help="per-connection cap in MB/s, 0 for unlimited")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
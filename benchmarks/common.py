@@ -0,0 +1,397 @@
+"""Shared helpers for the offline benchmarks: importing the bot and local HTTP stand-ins."""
+import asyncio
+import collections
+import importlib
+import inspect
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot(workdir: str = None):
+    """Imports master_bot with dummy credentials from inside a scratch directory.
+
+    TelegramClient refuses empty API credentials and writes its session file into the
+    working directory at import time, so both are redirected away from the checkout.
+    """
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', '0' * 32)
+    os.environ.setdefault('GOFILE_TOKEN', 'benchmark')
+    os.chdir(workdir or tempfile.mkdtemp(prefix="gofile_bench_"))
+    if REPO_ROOT not in sys.path: sys.path.insert(0, REPO_ROOT)
+    return importlib.import_module('master_bot')
+
+
+class Throttle:
+    """Caps a single connection to `bandwidth` bytes/s (0 = unlimited)."""
+    def __init__(self, bandwidth: int):
+        self.bandwidth, self.sent, self.start = bandwidth, 0, time.monotonic()
+
+    def wait(self, nbytes: int):
+        if not self.bandwidth: return
+        self.sent += nbytes
+        ahead = self.sent / self.bandwidth - (time.monotonic() - self.start)
+        if ahead > 0: time.sleep(ahead)
+
+
+def make_payload(size: int) -> bytes:
+    return (bytes(range(256)) * (size // 256 + 1))[:size]
+
+
+class RangeFileServer:
+    """Serves one in-memory payload at /file with Range support and a per-connection bandwidth cap."""
+    def __init__(self, payload: bytes, bandwidth: int = 0, latency: float = 0.0):
+        self.payload, self.bandwidth, self.latency = payload, bandwidth, latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+            def do_GET(self):
+                server.requests += 1
+                if server.latency: time.sleep(server.latency)
+                start, end = 0, len(server.payload) - 1
+                status = 200
+                if (header := self.headers.get("Range", "")).startswith("bytes="):
+                    first, _, last = header[6:].partition("-")
+                    start, end, status = int(first), int(last) if last else end, 206
+                body = memoryview(server.payload)[start:end + 1]
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 206: self.send_header("Content-Range", f"bytes {start}-{end}/{len(server.payload)}")
+                self.end_headers()
+                throttle = Throttle(server.bandwidth)
+                for offset in range(0, len(body), 64 * 1024):
+                    piece = body[offset:offset + 64 * 1024]
+                    try: self.wfile.write(piece)
+                    except (BrokenPipeError, ConnectionResetError): return
+                    throttle.wait(len(piece))
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/file"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown(); self.httpd.server_close()
+
+
+class FakeGoFileServer:
+    """Local stand-in for api.gofile.io, its upload servers and its content servers.
+
+    Serves /accounts, /servers, /contents/<id>, the wt script, uploads and Range
+    downloads of a synthetic folder tree. Every request waits `latency` seconds and
+    bodies in either direction are capped at `bandwidth` bytes/s per connection.
+    `calls` counts requests per endpoint.
+    """
+    def __init__(self, latency: float = 0.0, bandwidth: int = 0):
+        self.latency, self.bandwidth = latency, bandwidth
+        self.contents = {}
+        self.payload = b""
+        self.calls = collections.Counter()
+        self.uploaded_bytes = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+
+            def do_POST(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path == "/accounts": return self._handle("accounts", lambda: self._json({"status": "ok", "data": {"token": "fake-token"}}))
+                if path == "/uploadFile": return self._handle("uploadFile", self._upload)
+                self._handle("unknown", lambda: self._json({"status": "error-notFound"}, 404))
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path == "/servers": return self._handle("servers", lambda: self._json({"status": "ok", "data": {"servers": [{"name": "store1", "zone": "eu"}]}}))
+                if path == "/dist/js/global.js": return self._handle("global.js", lambda: self._send(200, b'appdata.wt = "fake-wt";', "application/javascript"))
+                if path.startswith("/contents/"): return self._handle("contents", lambda: self._contents(path.split("/")[2]))
+                if path.startswith("/download/"): return self._handle("download", lambda: self._download(path.split("/")[2]))
+                self._handle("unknown", lambda: self._json({"status": "error-notFound"}, 404))
+
+            def do_HEAD(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path.startswith("/download/"): return self._handle("head", lambda: self._download(path.split("/")[2], head=True))
+                self._handle("unknown", lambda: self._send(404, b""))
+
+            def _handle(self, endpoint, respond):
+                with server._lock: server.calls[endpoint] += 1
+                if server.latency: time.sleep(server.latency)
+                try: respond()
+                except (BrokenPipeError, ConnectionResetError): self.close_connection = True
+
+            def _send(self, status, body, content_type="application/octet-stream", headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers: self.send_header(name, value)
+                self.end_headers()
+                if self.command == "HEAD": return
+                throttle = Throttle(server.bandwidth)
+                for offset in range(0, len(body), 64 * 1024):
+                    piece = body[offset:offset + 64 * 1024]
+                    self.wfile.write(piece); throttle.wait(len(piece))
+
+            def _json(self, data, status=200):
+                self._send(status, json.dumps(data).encode(), "application/json")
+
+            def _contents(self, content_id):
+                if (entry := server.contents.get(content_id)) is None: return self._json({"status": "error-notFound"}, 404)
+                data = dict(entry)
+                if entry["type"] == "folder":
+                    data["children"] = {child_id: server.contents[child_id] for child_id in entry["children"]}
+                self._json({"status": "ok", "data": data})
+
+            def _download(self, content_id, head=False):
+                if (entry := server.contents.get(content_id)) is None or entry["type"] != "file": return self._send(404, b"")
+                size = entry["size"]
+                start, end, status = 0, size - 1, 200
+                if (header := self.headers.get("Range", "")).startswith("bytes="):
+                    first, _, last = header[6:].partition("-")
+                    start, end, status = int(first), min(int(last), size - 1) if last else size - 1, 206
+                headers = [("ETag", f'"{content_id}-{size}"'), ("Accept-Ranges", "bytes")]
+                if status == 206: headers.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+                body = memoryview(server.payload)[start:end + 1] if not head else memoryview(server.payload)[:size]
+                self._send(status, body, headers=headers)
+
+            def _upload(self):
+                throttle = Throttle(server.bandwidth)
+                received = 0
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    while (length := int(self.rfile.readline().split(b";")[0], 16)):
+                        received += self._drain(length, throttle); self.rfile.readline()
+                    self.rfile.readline()
+                else:
+                    received = self._drain(int(self.headers.get("Content-Length", 0)), throttle)
+                content_id = server.add_file("upload.bin", received, parent=None)
+                with server._lock: server.uploaded_bytes += received
+                self._json({"status": "ok", "data": {"downloadPage": f"https://gofile.io/d/{content_id}", "id": content_id}})
+
+            def _drain(self, length, throttle):
+                remaining = length
+                while remaining and (piece := self.rfile.read(min(remaining, 64 * 1024))):
+                    remaining -= len(piece); throttle.wait(len(piece))
+                return length - remaining
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _new_id(self) -> str:
+        return f"c{next(self._ids):06d}"
+
+    def add_folder(self, name: str, parent: str = None) -> str:
+        content_id = self._new_id()
+        self.contents[content_id] = {"id": content_id, "type": "folder", "name": name, "children": []}
+        if parent: self.contents[parent]["children"].append(content_id)
+        return content_id
+
+    def add_file(self, name: str, size: int, parent: str = None) -> str:
+        with self._lock:
+            content_id = self._new_id()
+            if size > len(self.payload): self.payload = make_payload(size)
+            link = f"{self.base_url}/download/{content_id}/{urllib.parse.quote(name)}"
+            self.contents[content_id] = {"id": content_id, "type": "file", "name": name, "size": size, "link": link}
+            if parent: self.contents[parent]["children"].append(content_id)
+        return content_id
+
+    def build_tree(self, files: int, file_size: int, fan_out: int = 4, files_per_folder: int = 4) -> str:
+        """Creates `files` files spread breadth-first over nested folders; returns the root folder ID."""
+        root = self.add_folder("bench")
+        folders, created = collections.deque([root]), 0
+        while created < files:
+            folder = folders.popleft()
+            for _ in range(min(files_per_folder, files - created)):
+                self.add_file(f"file_{created:05d}.bin", file_size, folder); created += 1
+            for index in range(fan_out): folders.append(self.add_folder(f"dir_{index}", folder))
+        return root
+
+    def file_url(self, content_id: str) -> str:
+        return self.contents[content_id]["link"]
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown(); self.httpd.server_close()
+
+
+class GoFileRedirect(HTTPAdapter):
+    """Sends requests for gofile.io and its subdomains to a FakeGoFileServer instead."""
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.netloc = urllib.parse.urlsplit(base_url).netloc
+
+    def send(self, request, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        if parts.hostname == "gofile.io" or (parts.hostname or "").endswith(".gofile.io"):
+            request.url = urllib.parse.urlunsplit(("http", self.netloc, parts.path, parts.query, ""))
+        return super().send(request, **kwargs)
+
+
+def route_gofile(bot, server: FakeGoFileServer):
+    """Points the bot's pooled GoFile sessions at `server`, keeping their pool sizes."""
+    for session in (bot.GOFILE_CLIENT.api, bot.GOFILE_CLIENT.content):
+        pool_size = session.get_adapter("https://").poolmanager.connection_pool_kw.get("maxsize", 10)
+        session.mount("https://", GoFileRedirect(server.base_url, pool_connections=16, pool_maxsize=pool_size))
+
+
+class FakeTelegramClient:
+    """Backs the client calls the bot makes: send_file, download_media and iter_download.
+
+    Files are "sent" by reading them and "downloaded" by producing synthetic bytes, both
+    paced to `bandwidth` bytes/s with `latency` per request. Status messages keep only
+    their latest text; `calls` counts responds, edits, deletes and transfers.
+    """
+    def __init__(self, bandwidth: int = 0, latency: float = 0.0, part_size: int = 512 * 1024):
+        self.bandwidth, self.latency, self.part_size = bandwidth, latency, part_size
+        self.calls = collections.Counter()
+        self.sent_bytes = self.received_bytes = 0
+        self.messages = []
+        self._ids = itertools.count(1000)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    async def _pace(self, start: float, nbytes: int):
+        ahead = nbytes / self.bandwidth - (time.monotonic() - start) if self.bandwidth else 0
+        await asyncio.sleep(max(ahead, 0))
+
+    async def respond(self, chat_id: int, text: str):
+        self.calls["respond"] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        message = FakeMessage(self, chat_id, text)
+        self.messages.append(message)
+        return message
+
+    async def send_file(self, entity, file, progress_callback=None, **kwargs):
+        self.calls["send_file"] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        if not isinstance(file, str): return FakeMessage(self, entity, "")
+        total, sent, start = os.path.getsize(file), 0, time.monotonic()
+        with open(file, "rb") as f:
+            while (part := f.read(self.part_size)):
+                sent += len(part)
+                await self._pace(start, sent)
+                if progress_callback and inspect.isawaitable(result := progress_callback(sent, total)): await result
+        self.sent_bytes += sent
+        return FakeMessage(self, entity, "")
+
+    async def iter_download(self, media, request_size: int = 512 * 1024, **kwargs):
+        self.calls["iter_download"] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        payload, received, start = make_payload(request_size), 0, time.monotonic()
+        while received < media.size:
+            part = payload[:min(request_size, media.size - received)]
+            received += len(part); self.received_bytes += len(part)
+            await self._pace(start, received)
+            yield part
+
+    async def download_media(self, media, file: str, progress_callback=None):
+        with open(file, "wb") as f:
+            async for part in self.iter_download(media, self.part_size):
+                f.write(part)
+                if progress_callback and inspect.isawaitable(result := progress_callback(f.tell(), media.size)): await result
+        return file
+
+
+class FakeMessage:
+    def __init__(self, client: FakeTelegramClient, chat_id: int, text: str):
+        self.client, self.chat_id, self.id, self.text = client, chat_id, client.next_id(), text
+
+    async def edit(self, text: str):
+        self.client.calls["edit"] += 1
+        self.text = text
+
+    async def delete(self):
+        self.client.calls["delete"] += 1
+
+
+class FakeMediaMessage(FakeMessage):
+    """A received document of `size` synthetic bytes, as seen by handle_file_upload."""
+    def __init__(self, client: FakeTelegramClient, chat_id: int, name: str, size: int, mime_type: str = "application/octet-stream"):
+        super().__init__(client, chat_id, "")
+        self.file = types.SimpleNamespace(name=name, size=size, mime_type=mime_type)
+        self.media = types.SimpleNamespace(size=size)
+        self.document = types.SimpleNamespace(id=self.id, access_hash=0)
+        self.photo = None
+
+    async def download_media(self, file: str, progress_callback=None):
+        return await self.client.download_media(self.media, file, progress_callback)
+
+
+class FakeEvent:
+    """The parts of a NewMessage event the bot's handlers use."""
+    def __init__(self, client: FakeTelegramClient, sender_id: int = 1, text: str = "", media: tuple = None):
+        self.client, self.sender_id, self.chat_id = client, sender_id, sender_id
+        self.is_private = True
+        self.message = FakeMediaMessage(client, self.chat_id, *media) if media else FakeMessage(client, self.chat_id, text)
+        self.text = text
+
+    async def respond(self, text: str):
+        return await self.client.respond(self.chat_id, text)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep while the block runs."""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+
+    @property
+    def max(self) -> float:
+        return max(self.samples, default=0.0)
+
+    @property
+    def p99(self) -> float:
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.99)] if ordered else 0.0
+
+
+def reset_peak_rss():
+    """Resets the kernel's high-water mark so peak_rss() covers only what runs next (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f: f.write("5")
+    except OSError: pass
+
+
+def peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024
+    except OSError: pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -9,10 +9,35 @@ import fnmatch
 import hashlib
 import urllib.parse
 import json
+import threading
+import uuid
+import contextlib
+import copy
+import contextvars
+import types
+import sqlite3
+import tempfile
+import queue
+import inspect
+import re
+import mimetypes
+import sys
+import traceback
+import bisect
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 from asyncio import CancelledError
-from telethon import TelegramClient, events
-from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename
+from telethon import TelegramClient, events, helpers, utils
+from telethon.errors import AuthKeyUnregisteredError, FloodWaitError, MessageNotModifiedError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename, InputFile, InputFileBig
 from pathvalidate import sanitize_filename
 
 # --- Your Credentials ---
@@ -24,25 +49,430 @@ GOFILE_TOKEN = os.environ.get('GOFILE_TOKEN')
 # --- Configuration ---
 DOWNLOAD_DIR = "downloads"
 USER_TASKS = {}
+# Files with these extensions (or any video/* MIME type) get a thumbnail and video attributes
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mkv', '.webm', '.avi', '.mov', '.flv', '.wmv', '.mpg', '.mpeg', '.ts', '.m2ts', '.mts', '.3gp', '.ogv'}
+
+# Folder mirroring pipeline: downloads run ahead of Telegram uploads, bounded by a byte/disk budget
+PIPELINE_DOWNLOAD_WORKERS = int(os.environ.get('PIPELINE_DOWNLOAD_WORKERS', 2))
+PIPELINE_PROBE_WORKERS = int(os.environ.get('PIPELINE_PROBE_WORKERS', 1))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 4))
+PIPELINE_MAX_BUFFERED_BYTES = int(os.environ.get('PIPELINE_MAX_BUFFERED_BYTES', 4 * 1024**3))
+PIPELINE_DISK_RESERVE_BYTES = int(os.environ.get('PIPELINE_DISK_RESERVE_BYTES', 512 * 1024**2))
+
+# Segmented GoFile downloads: files above the size threshold are fetched as N parallel Range requests
+SEGMENTED_DOWNLOAD_CONNECTIONS = int(os.environ.get('SEGMENTED_DOWNLOAD_CONNECTIONS', 1))
+SEGMENTED_DOWNLOAD_MIN_SIZE = int(os.environ.get('SEGMENTED_DOWNLOAD_MIN_SIZE', 64 * 1024**2))
+SEGMENTED_DOWNLOAD_RETRIES = int(os.environ.get('SEGMENTED_DOWNLOAD_RETRIES', 3))
+SEGMENT_CHUNK_SIZE = 256 * 1024
+
+# Streaming GoFile uploads read the file through one fixed buffer of this size
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024**2))
+
+# Diskless relay: Telegram files and links are piped straight into the GoFile upload through a ring buffer
+RELAY_STREAMING = os.environ.get('RELAY_STREAMING', '').lower() in ('1', 'true', 'yes')
+RELAY_BUFFER_SIZE = int(os.environ.get('RELAY_BUFFER_SIZE', 8 * 1024**2))
+
+# Job scheduling: jobs beyond these caps wait in a per-user round-robin queue
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 3))
+MAX_JOBS_PER_USER = int(os.environ.get('MAX_JOBS_PER_USER', 1))
+# What running jobs have written is re-measured in the background at most this often (seconds)
+DISK_USAGE_REFRESH_INTERVAL = float(os.environ.get('DISK_USAGE_REFRESH_INTERVAL', 2))
+
+# Folder listing: how many subfolders are fetched from the GoFile API at once
+LISTING_FAN_OUT = int(os.environ.get('LISTING_FAN_OUT', 4))
+
+# Download links are cached per content ID and re-fetched after this many seconds or on a 4xx
+LINK_CACHE_TTL = int(os.environ.get('LINK_CACHE_TTL', 600))
+
+# Shared GoFile client: guest token and wt are reused across jobs, the upload server list is re-read after this TTL
+GOFILE_SESSION_TTL = int(os.environ.get('GOFILE_SESSION_TTL', 6 * 3600))
+GOFILE_SERVERS_TTL = int(os.environ.get('GOFILE_SERVERS_TTL', 300))
+
+# Deduplication index: repeated Telegram files, links and identical content are answered with the stored link
+DEDUP_DB_PATH = os.environ.get('DEDUP_DB_PATH', 'gofile_index.sqlite3')
+DEDUP_TTL = int(os.environ.get('DEDUP_TTL', 30 * 86400))
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', 50000))
+DEDUP_VERIFY_AFTER = int(os.environ.get('DEDUP_VERIFY_AFTER', 3600))
+
+# Job journal: folder jobs record per-file progress here and are resumed after a restart
+JOURNAL_DB_PATH = os.environ.get('JOURNAL_DB_PATH', 'jobs.sqlite3')
+JOURNAL_CHECKPOINT_INTERVAL = float(os.environ.get('JOURNAL_CHECKPOINT_INTERVAL', 5))
+
+# Parallel Telegram transfers: large files move as concurrent 512 KiB parts over several MTProto senders
+TELEGRAM_TRANSFER_WORKERS = int(os.environ.get('TELEGRAM_TRANSFER_WORKERS', 4))
+TELEGRAM_PARALLEL_MIN_SIZE = int(os.environ.get('TELEGRAM_PARALLEL_MIN_SIZE', 10 * 1024**2))
+TELEGRAM_PART_SIZE = 512 * 1024
+TELEGRAM_PART_RETRIES = 3
+
+# Status messages: all edits go through one coalescing updater with a global rate budget
+STATUS_EDITS_PER_SECOND = float(os.environ.get('STATUS_EDITS_PER_SECOND', 2))
+STATUS_MIN_INTERVAL = float(os.environ.get('STATUS_MIN_INTERVAL', 3))
+
+# Media inspection: one seeking ffmpeg run per video yields both metadata and the thumbnail
+MEDIA_PROBE_PROCESSES = int(os.environ.get('MEDIA_PROBE_PROCESSES', 2))
+MEDIA_PROBE_CACHE_SIZE = int(os.environ.get('MEDIA_PROBE_CACHE_SIZE', 256))
+THUMBNAIL_SEEK_SECONDS = 1
+THUMBNAIL_WIDTH = 320
+
+# Runtime metrics: Prometheus text format on a local port (0 disables) and a watchdog for calls that block the event loop
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+LOOP_BLOCK_THRESHOLD = float(os.environ.get('LOOP_BLOCK_THRESHOLD', 0.25))
+EXECUTOR_WORKERS = int(os.environ.get('EXECUTOR_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
 
 # --- Setup Logging ---
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# =====================================================================================
+# RUNTIME METRICS
+# =====================================================================================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, float('inf'))
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum, self.count = 0.0, 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value; self.count += 1
+
+class Metrics:
+    """In-process counters and latency histograms, rendered in the Prometheus text format.
+
+    Stages are timed with `with METRICS.timer(stage):` from threads and coroutines alike and
+    transferred bytes are counted per direction. State that is already kept elsewhere
+    (scheduler queues, USER_TASKS, the executor, cache stats) is registered as a collector
+    and only read at scrape time.
+    """
+    def __init__(self, prefix: str = "gofile_bot"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.bytes = {}
+        self.counters = {}
+        self._byte_samples = deque(maxlen=11)
+        self._collectors = []
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try: yield
+        finally: self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock: self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_lag(self, seconds: float):
+        with self._lock: self.loop_lag.observe(seconds)
+
+    def add_bytes(self, direction: str, nbytes: int):
+        with self._lock: self.bytes[direction] = self.bytes.get(direction, 0) + nbytes
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock: self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_rates(self):
+        """Called about once a second; bytes/s are averaged over the last ten samples."""
+        with self._lock: self._byte_samples.append((time.monotonic(), dict(self.bytes)))
+
+    def rates(self) -> dict:
+        if len(self._byte_samples) < 2: return {}
+        (first_at, first), (last_at, last) = self._byte_samples[0], self._byte_samples[-1]
+        return {direction: (total - first.get(direction, 0)) / (last_at - first_at) for direction, total in last.items()}
+
+    def collector(self, name: str, kind: str, help_text: str, read, label: str = None):
+        """Registers a value read at scrape time: a number, or a {label value: number} dict."""
+        self._collectors.append((name, kind, help_text, read, label))
+
+    def render(self) -> str:
+        p, lines = self.prefix, []
+        def family(name, kind, help_text):
+            lines.extend((f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} {kind}"))
+        def histogram(name, histogram, labels=""):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'{p}_{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.extend((f"{p}_{name}_sum{suffix} {histogram.sum}", f"{p}_{name}_count{suffix} {histogram.count}"))
+
+        with self._lock:
+            family("stage_seconds", "histogram", "Time spent per stage of a transfer")
+            for stage, stage_histogram in sorted(self.stages.items()): histogram("stage_seconds", stage_histogram, f'stage="{stage}"')
+            family("event_loop_lag_seconds", "histogram", "How late the event loop woke up from a short sleep")
+            histogram("event_loop_lag_seconds", self.loop_lag)
+            family("transferred_bytes_total", "counter", "Bytes moved per direction")
+            lines.extend(f'{p}_transferred_bytes_total{{direction="{d}"}} {n}' for d, n in sorted(self.bytes.items()))
+            for name, value in sorted(self.counters.items()):
+                family(f"{name}_total", "counter", name.replace("_", " ").capitalize())
+                lines.append(f"{p}_{name}_total {value}")
+        family("transfer_bytes_per_second", "gauge", "Bytes/s per direction over the last ten seconds")
+        lines.extend(f'{p}_transfer_bytes_per_second{{direction="{d}"}} {rate:.1f}' for d, rate in sorted(self.rates().items()))
+        for name, kind, help_text, read, label in self._collectors:
+            try: value = read()
+            except Exception as e:
+                logger.debug(f"Metrics collector {name} failed: {e}"); continue
+            family(name, kind, help_text)
+            if isinstance(value, dict): lines.extend(f'{p}_{name}{{{label}="{key}"}} {v}' for key, v in sorted(value.items()))
+            else: lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """The event loop's default executor, counting queued and running calls to show saturation."""
+    def __init__(self, max_workers: int = EXECUTOR_WORKERS):
+        super().__init__(max_workers=max_workers, thread_name_prefix="executor")
+        self._counts_lock = threading.Lock()
+        self.queued, self.active = 0, 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._counts_lock: self.queued += 1
+        def run():
+            with self._counts_lock: self.queued -= 1; self.active += 1
+            try: return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock: self.active -= 1
+        return super().submit(run)
+
+class LoopMonitor:
+    """Event-loop heartbeat plus a watchdog thread that reports when the beats stop.
+
+    The heartbeat records how late each short sleep wakes up. When no beat lands for
+    LOOP_BLOCK_THRESHOLD, the watchdog logs the loop thread's current stack once per stall,
+    which points at the call holding the loop.
+    """
+    def __init__(self, interval: float = 0.05, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval, self.threshold = interval, threshold
+        self.lag = 0.0
+        self._last_beat = time.monotonic()
+        self._thread_id = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        asyncio.ensure_future(self._beat())
+        if self.threshold > 0: threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def _beat(self):
+        sampled_at = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = now = time.monotonic()
+            self.lag = now - started - self.interval
+            METRICS.observe_lag(self.lag)
+            if now - sampled_at >= 1:
+                METRICS.sample_rates(); sampled_at = now
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 2)
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled > self.threshold and beat != reported:
+                reported = beat
+                frame = sys._current_frames().get(self._thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+                METRICS.inc("event_loop_blocks")
+                logger.warning(f"Event loop blocked for {stalled:.2f}s so far; the loop thread is at:\n{stack}")
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    """Serves METRICS at /metrics from a daemon thread, so scrapes still answer while the loop is blocked."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+        def do_GET(self):
+            if urlparse(self.path).path != "/metrics": return self.send_error(404)
+            body = METRICS.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics are served at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+METRICS = Metrics()
+EXECUTOR = InstrumentedExecutor()
+LOOP_MONITOR = LoopMonitor()
+
 
 # =====================================================================================
 # HELPER CLASSES (Faithful implementation from gofile-dl)
 # =====================================================================================
 
 class GoFileFile:
-    def __init__(self, link: str, dest: str, size: int, name: str):
+    def __init__(self, link: str, dest: str, size: int, name: str, id: str = None, parent_id: str = None):
         self.link, self.dest, self.size, self.name = link, dest, size, name
+        self.id, self.parent_id = id, parent_id
+        # Set by GoFileDownloader.download once it has picked a mode for this file
+        self.segmented = False
+
+def request_token(request) -> str | None:
+    """The accountToken cookie a GoFile download request was sent with."""
+    cookie = request.headers.get("Cookie", "") if request is not None else ""
+    return cookie.partition("accountToken=")[2].split(";")[0] or None
+
+def is_gofile_auth_error(status_code: int, status: str = None) -> bool:
+    """True when a GoFile API answer means the cached token or wt is no longer accepted."""
+    return status_code in (401, 403) or any(word in (status or "").lower() for word in ("auth", "token", "wt"))
+
+class GoFileClient:
+    """Process-wide access layer for every GoFile call.
+
+    Keeps one keep-alive pool for the API hosts and one for the content/upload servers, and
+    caches the guest token, the `wt` website token and the upload server list with an
+    expiry. Callers invalidate entries when a request made with them fails, naming the value
+    that failed, so a burst of failures from many threads rotates an entry only once; `stats`
+    counts hits, misses and invalidations per entry.
+    """
+    def __init__(self):
+        self.api = self._pooled_session(LISTING_FAN_OUT * MAX_CONCURRENT_JOBS)
+        self.content = self._pooled_session(max(SEGMENTED_DOWNLOAD_CONNECTIONS, 1) * PIPELINE_DOWNLOAD_WORKERS * MAX_CONCURRENT_JOBS)
+        self._cache = {}
+        self._locks = {key: threading.Lock() for key in ("token", "wt", "servers")}
+        self.stats = {key: {"hits": 0, "misses": 0, "invalidations": 0} for key in self._locks}
+
+    def _pooled_session(self, pool_size: int) -> requests.Session:
+        session = requests.Session()
+        for scheme in ("https://", "http://"):
+            session.mount(scheme, requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max(pool_size, 4)))
+        return session
+
+    def _cached(self, key: str, ttl: int, fetch):
+        with self._locks[key]:
+            value, expires_at = self._cache.get(key, (None, 0))
+            if value is not None and time.time() < expires_at:
+                self.stats[key]["hits"] += 1
+                return value
+            self.stats[key]["misses"] += 1
+            value = fetch()
+            self._cache[key] = (value, time.time() + ttl)
+            return value
+
+    def invalidate(self, key: str, used=None):
+        """Drops a cached entry; with `used`, only while the cache still holds that value."""
+        with self._locks[key]:
+            value, _ = self._cache.get(key, (None, 0))
+            if value is None or (used is not None and value != used): return
+            del self._cache[key]
+            self.stats[key]["invalidations"] += 1
+
+    def token(self) -> str:
+        return self._cached("token", GOFILE_SESSION_TTL, self._fetch_token)
+
+    def wt(self) -> str:
+        return self._cached("wt", GOFILE_SESSION_TTL, self._fetch_wt)
+
+    def servers(self) -> list[str]:
+        return self._cached("servers", GOFILE_SERVERS_TTL, self._fetch_servers)
+
+    def _fetch_token(self) -> str:
+        try:
+            data = self.api.post("https://api.gofile.io/accounts", timeout=30).json()
+            if data["status"] == "ok": return data["data"]["token"]
+            raise Exception("Could not get guest token")
+        except Exception as e: logger.error(f"Failed to update token: {e}"); raise
+
+    def _fetch_wt(self) -> str:
+        try:
+            alljs = self.api.get("https://gofile.io/dist/js/global.js", timeout=30).text
+            if 'appdata.wt = "' in alljs: return alljs.split('appdata.wt = "')[1].split('"')[0]
+            raise Exception("Could not find wt in global.js")
+        except Exception as e: logger.error(f"Failed to update wt: {e}"); raise
+
+    def _fetch_servers(self) -> list[str]:
+        server_response = self.api.get("https://api.gofile.io/servers", timeout=30)
+        server_response.raise_for_status()
+        return [server["name"] for server in server_response.json()["data"]["servers"]]
+
+class LinkCache:
+    """Download links keyed by GoFile content ID.
+
+    Every /contents response is recorded, so a folder listing warms the links of all its
+    children. A link is re-fetched when it outlives the TTL or when a download of it gets a
+    4xx; either way the whole parent folder is refreshed in one call, and threads waiting on
+    the same folder reuse that result instead of issuing their own.
+    """
+    def __init__(self, gofile, ttl: int = LINK_CACHE_TTL):
+        self.gofile, self.ttl = gofile, ttl
+        self._links = {}
+        self._passwords = {}
+        self._lock = threading.Lock()
+        self._folder_locks = {}
+
+    def record(self, content_id: str, data: dict, password: str = None):
+        now = time.time()
+        with self._lock:
+            self._passwords[content_id] = password
+            if data["type"] == "folder":
+                for child_id, child_info in data.get("children", {}).items():
+                    if child_info["type"] == "file": self._links[child_id] = (urllib.parse.unquote(child_info["link"]), now)
+            else:
+                self._links[content_id] = (urllib.parse.unquote(data["link"]), now)
+
+    def get(self, file: GoFileFile) -> str:
+        link, fetched_at = self._links.get(file.id, (None, 0))
+        if link and time.time() - fetched_at < self.ttl: return link
+        return self.refresh(file)
+
+    def refresh(self, file: GoFileFile, failed_link: str = None) -> str:
+        if file.id is None: return file.link
+        folder_id = file.parent_id or file.id
+        with self._lock: folder_lock = self._folder_locks.setdefault(folder_id, threading.Lock())
+        with folder_lock:
+            link, fetched_at = self._links.get(file.id, (None, 0))
+            if link and link != failed_link and time.time() - fetched_at < self.ttl: return link
+            with METRICS.timer("link_refresh"):
+                self.gofile._fetch_contents(folder_id, self._passwords.get(folder_id))
+            if file.id not in self._links: raise Exception(f"{file.name} is no longer in its GoFile folder")
+            return self._links[file.id][0]
+
+class RangeNotSupported(Exception):
+    pass
+
+class DownloadAborted(Exception):
+    pass
 
 class GoFileDownloader:
-    def __init__(self, token): 
+    def __init__(self, token: str = None, connections: int = SEGMENTED_DOWNLOAD_CONNECTIONS, link_cache: LinkCache = None):
+        # A fixed token is only for callers outside the shared session; otherwise every request
+        # reads the current one, so a re-fetched token reaches downloads already in progress
         self.token = token
+        self.connections = max(1, connections)
+        self.link_cache = link_cache
+        self.session = GOFILE_CLIENT.content
+        # Set by the owning job when it ends; running downloads stop at their next chunk
+        self.aborted = False
+
     def download(self, file: GoFileFile, progress_callback=None):
-        link, dest, total_size = file.link, file.dest, file.size
+        parts_path = file.dest + ".parts"
+        if self.link_cache:
+            try: file.link = self.link_cache.get(file)
+            except Exception as e: logger.warning(f"Could not refresh link for {file.name}, using the listed one: {e}")
+        # A .parts sidecar exists from before the file is first sized until the last segment is done, so
+        # with one present the file is sparse and only the segmented path (whatever the current
+        # connection count) may resume it. Without one, a partial file came from a single-stream download.
+        segmented = self.connections > 1 and file.size >= SEGMENTED_DOWNLOAD_MIN_SIZE and not os.path.exists(file.dest)
+        file.segmented = os.path.exists(parts_path) or segmented
+        if file.segmented:
+            try:
+                return self._download_segmented(file, progress_callback)
+            except RangeNotSupported as e:
+                logger.warning(f"Segmented download unavailable for {file.name}, falling back to one stream: {e}")
+                for path in (file.dest, parts_path):
+                    if os.path.exists(path): os.remove(path)
+                file.segmented = False
+        dest, total_size = file.dest, file.size
         os.makedirs(os.path.dirname(dest), exist_ok=True)
         downloaded_bytes = os.path.getsize(dest) if os.path.exists(dest) else 0
         if downloaded_bytes >= total_size:
@@ -50,15 +480,11 @@ class GoFileDownloader:
             return True
         
         try:
-            headers = {"Cookie": f"accountToken={self.token}", "Range": f"bytes={downloaded_bytes}-"}
-            with requests.get(link, headers=headers, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                with open(dest, "ab") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded_bytes += len(chunk)
-                            if progress_callback: progress_callback(downloaded_bytes, total_size)
+            try:
+                self._download_stream(file, downloaded_bytes, progress_callback)
+            except requests.exceptions.HTTPError as e:
+                if not self._refresh_stale_link(file, e): raise
+                self._download_stream(file, os.path.getsize(dest) if os.path.exists(dest) else 0, progress_callback)
             return True
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to download {file.name}: {e}")
@@ -66,79 +492,982 @@ class GoFileDownloader:
                 os.remove(dest)
             return False
 
+    def _download_stream(self, file: GoFileFile, downloaded_bytes: int, progress_callback=None):
+        headers = {"Cookie": f"accountToken={self._current_token()}", "Range": f"bytes={downloaded_bytes}-"}
+        with self.session.get(file.link, headers=headers, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            with open(file.dest, "ab") as f:
+                for chunk in r.iter_content(chunk_size=8192):
+                    if self.aborted: raise DownloadAborted(f"download of {file.name} aborted")
+                    if chunk:
+                        f.write(chunk)
+                        downloaded_bytes += len(chunk)
+                        METRICS.add_bytes("gofile_download", len(chunk))
+                        if progress_callback: progress_callback(downloaded_bytes, file.size)
+
+    def _current_token(self) -> str:
+        return self.token or GOFILE_CLIENT.token()
+
+    def _refresh_stale_link(self, file: GoFileFile, error: requests.exceptions.HTTPError) -> bool:
+        """Swaps in a fresh link (and token, after a 401/403) after a 4xx; returns False when there is nothing to retry with."""
+        if error.response is None or not 400 <= error.response.status_code < 500: return False
+        token_refreshed = error.response.status_code in (401, 403) and self.token is None
+        if token_refreshed: GOFILE_CLIENT.invalidate("token", used=request_token(error.request))
+        if self.link_cache is None: return token_refreshed
+        try:
+            file.link = self.link_cache.refresh(file, failed_link=file.link)
+            return True
+        except Exception as e:
+            logger.warning(f"Link refresh for {file.name} failed: {e}")
+            return False
+
+    def _download_segmented(self, file: GoFileFile, progress_callback=None):
+        dest, total_size = file.dest, file.size
+        parts_path = dest + ".parts"
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        segments = self._load_segments(dest, total_size)
+        lock = threading.Lock()
+        state = {"downloaded": sum(pos - start for start, pos, _ in segments), "saved_at": time.time()}
+
+        def report(nbytes):
+            with lock:
+                state["downloaded"] += nbytes
+                downloaded = state["downloaded"]
+                if time.time() - state["saved_at"] > 1:
+                    self._save_segments(parts_path, segments); state["saved_at"] = time.time()
+            if progress_callback: progress_callback(downloaded, total_size)
+
+        def fetch(segment):
+            for attempt in range(SEGMENTED_DOWNLOAD_RETRIES + 1):
+                try:
+                    return self._fetch_segment(file, fd, segment, report)
+                except requests.exceptions.RequestException as e:
+                    if attempt == SEGMENTED_DOWNLOAD_RETRIES: raise
+                    if isinstance(e, requests.exceptions.HTTPError) and self._refresh_stale_link(file, e): continue
+                    logger.warning(f"Segment {segment[0]}-{segment[2]} of {file.name} failed at byte {segment[1]}, retrying: {e}")
+                    time.sleep(2 ** attempt)
+
+        # The sidecar must exist before the file reaches full size, or a crash in between would leave a
+        # full-size, mostly empty file that looks complete
+        self._save_segments(parts_path, segments)
+        fd = os.open(dest, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, total_size)
+            with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                futures = [pool.submit(fetch, segment) for segment in segments if segment[1] <= segment[2]]
+                errors = [e for e in (f.exception() for f in futures) if e]
+        finally:
+            os.close(fd)
+        for error in errors:
+            if isinstance(error, (RangeNotSupported, DownloadAborted)): raise error
+        if errors:
+            # Keep the .parts sidecar so the next attempt only re-fetches the unfinished segments
+            self._save_segments(parts_path, segments)
+            logger.error(f"Failed to download {file.name}: {errors[0]}")
+            return False
+        if os.path.exists(parts_path): os.remove(parts_path)
+        if progress_callback: progress_callback(total_size, total_size)
+        return True
+
+    def _fetch_segment(self, file: GoFileFile, fd: int, segment: list, report):
+        headers = {"Cookie": f"accountToken={self._current_token()}", "Range": f"bytes={segment[1]}-{segment[2]}"}
+        with self.session.get(file.link, headers=headers, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            if r.status_code != 206: raise RangeNotSupported(f"server answered {r.status_code} to a Range request")
+            for chunk in r.iter_content(chunk_size=SEGMENT_CHUNK_SIZE):
+                if self.aborted: raise DownloadAborted(f"download of {file.name} aborted")
+                if not chunk: continue
+                chunk = chunk[:segment[2] - segment[1] + 1]
+                os.pwrite(fd, chunk, segment[1])
+                segment[1] += len(chunk)
+                METRICS.add_bytes("gofile_download", len(chunk))
+                report(len(chunk))
+                if segment[1] > segment[2]: break
+        if segment[1] <= segment[2]:
+            raise requests.exceptions.ChunkedEncodingError(f"connection closed at byte {segment[1]}")
+
+    def _load_segments(self, dest: str, total_size: int) -> list:
+        """Segments are [start, next_byte, end] with an inclusive end, persisted in the .parts sidecar."""
+        parts_path = dest + ".parts"
+        if os.path.exists(parts_path) and os.path.exists(dest):
+            try:
+                with open(parts_path) as f: saved = json.load(f)
+                if saved["size"] == total_size: return saved["segments"]
+            except (OSError, ValueError, KeyError): pass
+        segment_size = math.ceil(total_size / self.connections)
+        return [[start, start, min(start + segment_size, total_size) - 1] for start in range(0, total_size, segment_size)]
+
+    def _save_segments(self, parts_path: str, segments: list):
+        # Written aside and renamed, so a crash mid-write never leaves the file without a readable sidecar
+        with open(parts_path + ".tmp", "w") as f: json.dump({"size": sum(end - start + 1 for start, _, end in segments), "segments": segments}, f)
+        os.replace(parts_path + ".tmp", parts_path)
+
 class GoFile:
-    def __init__(self):
-        self.token = ""
-        self.wt = ""
+    def __init__(self, client: GoFileClient = None):
+        self.client = client or GOFILE_CLIENT
+        self.link_cache = LinkCache(self)
+
+    @property
+    def token(self) -> str:
+        return self.client.token()
+
+    @property
+    def wt(self) -> str:
+        return self.client.wt()
 
     def _update_session(self):
-        if not self.token:
-            try:
-                data = requests.post("https://api.gofile.io/accounts").json()
-                if data["status"] == "ok": self.token = data["data"]["token"]
-                else: raise Exception("Could not get guest token")
-            except Exception as e: logger.error(f"Failed to update token: {e}"); raise
-        if not self.wt:
-            try:
-                alljs = requests.get("https://gofile.io/dist/js/global.js").text
-                if 'appdata.wt = "' in alljs: self.wt = alljs.split('appdata.wt = "')[1].split('"')[0]
-                else: raise Exception("Could not find wt in global.js")
-            except Exception as e: logger.error(f"Failed to update wt: {e}"); raise
+        self.client.token(); self.client.wt()
 
-    def get_folder_contents(self, content_id: str, output_dir: str, password: str = None) -> list[GoFileFile]:
-        self._update_session()
+    def _fetch_contents(self, content_id: str, password: str = None) -> dict:
         hash_password = hashlib.sha256(password.encode()).hexdigest() if password else ""
-        api_url = f"https://api.gofile.io/contents/{content_id}?wt={self.wt}&cache=true&password={hash_password}"
-        headers = {"Authorization": "Bearer " + self.token}
-        response = requests.get(api_url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        if data["status"] != "ok": raise Exception(f"GoFile API Error: {data.get('status')}")
+        for attempt in range(2):
+            token, wt = self.token, self.wt
+            api_url = f"https://api.gofile.io/contents/{content_id}?wt={wt}&cache=true&password={hash_password}"
+            headers = {"Authorization": "Bearer " + token}
+            with METRICS.timer("gofile_listing"):
+                response = self.client.api.get(api_url, headers=headers, timeout=30)
+            try: data = response.json()
+            except ValueError: data = {}
+            status = data.get("status")
+            if response.ok and status == "ok": break
+            # Only stale credentials are worth a retry with fresh ones; rotating the shared token on
+            # any failure (a dead link, say) would pull it from under every running job
+            if attempt or not is_gofile_auth_error(response.status_code, status):
+                response.raise_for_status()
+                raise Exception(f"GoFile API Error: {status}")
+            self.client.invalidate("token", used=token); self.client.invalidate("wt", used=wt)
         if data["data"].get("passwordStatus", "passwordOk") != "passwordOk": raise Exception("Invalid password")
-        files_list = []
-        def recurse_children(children, current_path):
-            for child_id, child_info in children.items():
+        self.link_cache.record(content_id, data["data"], password)
+        return data["data"]
+
+    async def iter_folder_contents(self, content_id: str, output_dir: str, password: str = None):
+        """Lists a GoFile folder tree, yielding each file as soon as its folder is listed.
+
+        Sibling subfolders are listed concurrently, at most LISTING_FAN_OUT API calls at a time,
+        over the shared pooled API session. Listing keeps running in the background between yields.
+        Each file lands in a directory named after its content ID, so entries that share a
+        (sanitized) name never download into the same path while keeping their own name.
+        """
+        loop = asyncio.get_running_loop()
+        found = asyncio.Queue()
+        slots = asyncio.Semaphore(LISTING_FAN_OUT)
+        tasks = set()
+
+        def list_folder(folder_id, path, is_root=False):
+            task = asyncio.ensure_future(walk(folder_id, path, is_root))
+            tasks.add(task)
+            task.add_done_callback(folder_done)
+
+        def folder_done(task):
+            tasks.discard(task)
+            if task.cancelled(): return
+            if task.exception(): found.put_nowait(task.exception())
+            elif not tasks: found.put_nowait(None)
+
+        def file_entry(file_id, info, path, parent_id=None):
+            filename = sanitize_filename(info["name"])
+            found.put_nowait(GoFileFile(link=urllib.parse.unquote(info["link"]), dest=os.path.join(path, file_id, filename), size=info["size"], name=filename, id=file_id, parent_id=parent_id))
+
+        async def walk(folder_id, path, is_root):
+            async with slots:
+                data = await loop.run_in_executor(None, self._fetch_contents, folder_id, password)
+            if data["type"] != "folder":
+                file_entry(folder_id, data, path)
+                return
+            if is_root: path = os.path.join(path, sanitize_filename(data["name"]))
+            for child_id, child_info in data.get("children", {}).items():
                 if child_info["type"] == "folder":
-                    new_path = os.path.join(current_path, sanitize_filename(child_info["name"]))
-                    files_list.extend(self.get_folder_contents(child_id, new_path, password))
+                    list_folder(child_id, os.path.join(path, sanitize_filename(child_info["name"])))
                 elif child_info["type"] == "file":
-                    filename = sanitize_filename(child_info["name"])
-                    files_list.append(GoFileFile(link=urllib.parse.unquote(child_info["link"]), dest=os.path.join(current_path, filename), size=child_info["size"], name=filename))
-        root_data = data["data"]
-        if root_data["type"] == "folder":
-            folder_name = sanitize_filename(root_data["name"])
-            new_output_dir = os.path.join(output_dir, folder_name)
-            recurse_children(root_data.get("children", {}), new_output_dir)
-        else:
-             filename = sanitize_filename(root_data["name"])
-             files_list.append(GoFileFile(link=urllib.parse.unquote(root_data["link"]), dest=os.path.join(output_dir, filename), size=root_data["size"], name=filename))
-        return files_list
-    
-    def refresh_folder_links(self, content_id: str, files_list: list[GoFileFile], password: str = None):
-        self._update_session()
-        hash_password = hashlib.sha256(password.encode()).hexdigest() if password else ""
-        api_url = f"https://api.gofile.io/contents/{content_id}?wt={self.wt}&cache=true&password={hash_password}"
-        headers = {"Authorization": "Bearer " + self.token}
-        response = requests.get(api_url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        if data["status"] != "ok": raise Exception(f"GoFile API Error: {data.get('status')}")
-        if data["data"].get("passwordStatus", "passwordOk") != "passwordOk": raise Exception("Invalid password")
-        link_mapping = {}
-        def map_children(children):
-            for child_id, child_info in children.items():
-                if child_info["type"] == "file":
-                    filename = sanitize_filename(child_info["name"])
-                    link_mapping[filename] = urllib.parse.unquote(child_info["link"])
-        root_data = data["data"]
-        if root_data["type"] == "folder":
-            map_children(root_data.get("children", {}))
+                    file_entry(child_id, child_info, path, parent_id=folder_id)
+
+        list_folder(content_id, output_dir, is_root=True)
+        try:
+            while (item := await found.get()) is not None:
+                if isinstance(item, Exception): raise item
+                yield item
+        finally:
+            for task in list(tasks): task.cancel()
+
+class UploadAborted(Exception):
+    pass
+
+class MultipartFileStream:
+    """A multipart/form-data body that requests can send without materialising it.
+
+    `source` only needs `readinto`; the file part is pulled through one reused buffer, so memory
+    stays at `chunk_size` whatever the upload size. The returned views are only valid until the
+    next read, which is fine for http.client as it sends each block before asking for the next.
+    """
+    def __init__(self, source, filename: str, size: int, field: str = "file", progress_callback=None, chunk_size: int = UPLOAD_CHUNK_SIZE, hasher=None):
+        self.source, self.size, self.progress_callback, self.hasher = source, size, progress_callback, hasher
+        self.boundary = uuid.uuid4().hex
+        quoted_name = filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+        self._head = (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{quoted_name}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self._buffer = memoryview(bytearray(chunk_size))
+        self._pos = 0
+        self.sent = 0
+        self.aborted = False
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self._head) + self.size + len(self._tail)
+
+    def read(self, n: int = -1):
+        if self.aborted: raise UploadAborted("upload aborted")
+        if n is None or n < 0: n = len(self._buffer)
+        head_end, file_end = len(self._head), len(self._head) + self.size
+        if self._pos < head_end:
+            data = self._head[self._pos:self._pos + n]
+        elif self._pos < file_end:
+            view = self._buffer[:min(n, len(self._buffer), file_end - self._pos)]
+            read = self.source.readinto(view)
+            if not read: raise IOError(f"source ended {file_end - self._pos} bytes early")
+            data = view[:read]
+            if self.hasher: self.hasher.update(data)
+            self.sent += read
+            METRICS.add_bytes("gofile_upload", read)
+            if self.progress_callback: self.progress_callback(self.sent, self.size)
         else:
-            filename = sanitize_filename(root_data["name"])
-            link_mapping[filename] = urllib.parse.unquote(root_data["link"])
-        for file_obj in files_list:
-            if file_obj.name in link_mapping:
-                file_obj.link = link_mapping[file_obj.name]
+            data = self._tail[self._pos - file_end:self._pos - file_end + n]
+        self._pos += len(data)
+        return data
+
+class RingBuffer:
+    """Bounded byte FIFO between an asyncio producer and a blocking reader thread.
+
+    Backpressure flows both ways: `write` awaits while the buffer is full and `readinto`
+    blocks while it is empty. `close(error)` ends the stream; the reader sees EOF or the error.
+    """
+    def __init__(self, capacity: int, loop):
+        self._buffer = bytearray(capacity)
+        self._start, self._length = 0, 0
+        self._cond = threading.Condition()
+        self._space = asyncio.Event()
+        self._loop = loop
+        self._closed, self._error = False, None
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            with self._cond:
+                capacity = len(self._buffer)
+                n = min(len(view), capacity - self._length)
+                if n:
+                    end = (self._start + self._length) % capacity
+                    first = min(n, capacity - end)
+                    self._buffer[end:end + first] = view[:first]
+                    self._buffer[:n - first] = view[first:n]
+                    self._length += n
+                    self._cond.notify_all()
+                else:
+                    self._space.clear()
+            if n: view = view[n:]
+            else: await self._space.wait()
+
+    def close(self, error: BaseException = None):
+        with self._cond:
+            self._closed, self._error = True, error
+            self._cond.notify_all()
+
+    def readinto(self, view) -> int:
+        with self._cond:
+            self._cond.wait_for(lambda: self._length or self._closed)
+            if self._error: raise IOError(f"relay source failed: {self._error!r}")
+            if not self._length: return 0
+            capacity = len(self._buffer)
+            n = min(len(view), self._length)
+            first = min(n, capacity - self._start)
+            view[:first] = self._buffer[self._start:self._start + first]
+            view[first:n] = self._buffer[:n - first]
+            self._start = (self._start + n) % capacity
+            self._length -= n
+        self._loop.call_soon_threadsafe(self._space.set)
+        return n
+
+GOFILE_CLIENT = GoFileClient()
+
+# =====================================================================================
+# DEDUPLICATION INDEX
+# =====================================================================================
+
+class DedupIndex:
+    """Persistent map from source identities to the GoFile downloadPage they produced.
+
+    Keys come from `telegram_media_key`, `url_key` and `content_key`; one upload is stored
+    under every key that described it. Entries expire after DEDUP_TTL, the least recently
+    used ones are trimmed beyond DEDUP_MAX_ENTRIES, and a hit older than DEDUP_VERIFY_AFTER
+    is checked against the GoFile API before it is trusted again.
+
+    Every method commits to SQLite, so async code calls them through the executor.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS uploads (key TEXT PRIMARY KEY, download_page TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL, verified_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)")
+            self._db.commit()
+
+    def lookup(self, keys: list[str]):
+        """Returns (download_page, verified_at) for the first known key, or None."""
+        if not self._db: return None
+        now = time.time()
+        with self._lock:
+            for key in filter(None, keys):
+                row = self._db.execute("SELECT download_page, created_at, verified_at FROM uploads WHERE key = ?", (key,)).fetchone()
+                if not row: continue
+                if now - row[1] > DEDUP_TTL:
+                    self._db.execute("DELETE FROM uploads WHERE key = ?", (key,)); self._db.commit(); continue
+                self._db.execute("UPDATE uploads SET last_used = ? WHERE key = ?", (now, key)); self._db.commit()
+                return row[0], row[2]
+        return None
+
+    def remember(self, keys: list[str], download_page: str, verified: bool = True):
+        if not self._db or not download_page: return
+        now = time.time()
+        with self._lock:
+            for key in filter(None, keys):
+                self._db.execute("INSERT INTO uploads (key, download_page, created_at, last_used, verified_at) VALUES (?, ?, ?, ?, ?) "
+                                 "ON CONFLICT(key) DO UPDATE SET download_page = excluded.download_page, last_used = excluded.last_used, verified_at = excluded.verified_at",
+                                 (key, download_page, now, now, now if verified else 0))
+            self._evict(now)
+            self._db.commit()
+
+    def forget(self, download_page: str):
+        if not self._db: return
+        with self._lock:
+            self._db.execute("DELETE FROM uploads WHERE download_page = ?", (download_page,)); self._db.commit()
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM uploads WHERE created_at < ?", (now - DEDUP_TTL,))
+        self._db.execute("DELETE FROM uploads WHERE key IN (SELECT key FROM uploads ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (DEDUP_MAX_ENTRIES,))
+
+    async def find_valid(self, keys: list[str]):
+        """Looks the keys up and re-checks stale hits with GoFile; returns a usable downloadPage or None."""
+        loop = asyncio.get_running_loop()
+        if not (hit := await loop.run_in_executor(None, self.lookup, keys)): return None
+        download_page, verified_at = hit
+        if time.time() - verified_at > DEDUP_VERIFY_AFTER:
+            if not await loop.run_in_executor(None, is_gofile_link_alive, download_page):
+                await loop.run_in_executor(None, self.forget, download_page); return None
+            await loop.run_in_executor(None, self.remember, keys, download_page)
+        return download_page
+
+def telegram_media_key(message) -> str | None:
+    media = message.document or message.photo
+    if media is None: return None
+    return f"tg:{media.id}:{media.access_hash}"
+
+def url_key(url: str, headers) -> str | None:
+    etag, length = headers.get('ETag'), headers.get('Content-Length')
+    if not (etag or length): return None
+    return f"url:{url}|etag={etag or ''}|length={length or ''}"
+
+def content_key(hasher) -> str:
+    return f"sha256:{hasher.hexdigest()}"
+
+def hash_file(filepath: str, algorithm=hashlib.sha256):
+    hasher = algorithm()
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE): hasher.update(chunk)
+    return hasher
+
+def is_gofile_link_alive(download_page: str) -> bool:
+    try:
+        GoFile()._fetch_contents(os.path.basename(urlparse(download_page).path))
+        return True
+    except Exception as e:
+        logger.info(f"Cached link {download_page} is no longer valid: {e}")
+        return False
+
+DEDUP_INDEX = DedupIndex(DEDUP_DB_PATH)
+
+# =====================================================================================
+# JOB JOURNAL
+# =====================================================================================
+
+class JobJournal:
+    """Crash-safe record of folder jobs, their files and per-file download offsets.
+
+    A job row lives from the moment a folder job starts until it completes, fails or is
+    stopped by the user; anything still present at startup is resumed. File states go
+    pending -> downloaded -> sent (or failed), and `offset` is the last checkpointed byte
+    count of a single-stream download, which is what the resume truncates back to.
+    Segmented downloads never journal an offset: their progress is not a contiguous prefix
+    and their own .parts sidecar already records what is safe to keep.
+
+    Writes are queued and committed in batches by a background thread, so the event loop
+    never waits on SQLite; reads flush the queue first.
+    """
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, user_id INTEGER, chat_id INTEGER, message_id INTEGER, url TEXT, temp_dir TEXT, created_at REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (job_id TEXT, file_id TEXT, name TEXT, dest TEXT, size INTEGER, state TEXT, offset INTEGER, PRIMARY KEY (job_id, file_id))")
+        self._db.commit()
+        self._writes = queue.Queue()
+        threading.Thread(target=self._writer, name="job-journal", daemon=True).start()
+
+    def _write(self, sql: str, params: tuple):
+        self._writes.put((sql, params))
+
+    def _writer(self):
+        while True:
+            batch = [self._writes.get()]
+            while not self._writes.empty(): batch.append(self._writes.get_nowait())
+            try:
+                with self._lock:
+                    for sql, params in batch: self._db.execute(sql, params)
+                    self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Job journal write failed: {e}")
+            finally:
+                for _ in batch: self._writes.task_done()
+
+    def flush(self):
+        """Blocks until every queued write is committed."""
+        self._writes.join()
+
+    def start_job(self, job_id: str, user_id: int, chat_id: int, message_id: int, url: str, temp_dir: str):
+        self._write("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", (job_id, user_id, chat_id, message_id, url, temp_dir, time.time()))
+        return JobLog(self, job_id)
+
+    def finish_job(self, job_id: str):
+        self._write("DELETE FROM files WHERE job_id = ?", (job_id,))
+        self._write("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def unfinished_jobs(self) -> list[tuple]:
+        self.flush()
+        with self._lock:
+            return self._db.execute("SELECT job_id, user_id, chat_id, message_id, url, temp_dir FROM jobs ORDER BY created_at").fetchall()
+
+    def restore_checkpoints(self, job_id: str):
+        """Cuts single-stream partial downloads back to their last journaled offset, dropping unconfirmed tails."""
+        self.flush()
+        with self._lock:
+            rows = self._db.execute("SELECT dest, offset FROM files WHERE job_id = ? AND state = 'pending'", (job_id,)).fetchall()
+        for dest, offset in rows:
+            if os.path.exists(dest) and not os.path.exists(dest + ".parts") and os.path.getsize(dest) > offset:
+                os.truncate(dest, offset)
+
+class JobLog:
+    """One job's view of the JobJournal, handed to the pipeline."""
+    def __init__(self, journal: JobJournal, job_id: str):
+        self.journal, self.job_id = journal, job_id
+        self._checkpointed_at = {}
+
+    def states(self) -> dict:
+        self.journal.flush()
+        with self.journal._lock:
+            return dict(self.journal._db.execute("SELECT file_id, state FROM files WHERE job_id = ?", (self.job_id,)).fetchall())
+
+    def record_file(self, file: GoFileFile):
+        self.journal._write("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, 'pending', 0)", (self.job_id, file.id, file.name, file.dest, file.size))
+
+    def set_state(self, file: GoFileFile, state: str):
+        self.journal._write("UPDATE files SET state = ? WHERE job_id = ? AND file_id = ?", (state, self.job_id, file.id))
+
+    def checkpoint(self, file: GoFileFile, offset: int):
+        now = time.time()
+        if now - self._checkpointed_at.get(file.id, 0) < JOURNAL_CHECKPOINT_INTERVAL: return
+        self._checkpointed_at[file.id] = now
+        self.journal._write("UPDATE files SET offset = ? WHERE job_id = ? AND file_id = ?", (offset, self.job_id, file.id))
+
+JOURNAL = JobJournal(JOURNAL_DB_PATH)
+
+# =====================================================================================
+# FOLDER MIRRORING PIPELINE
+# =====================================================================================
+
+class ByteBudget:
+    """Bounds how many downloaded-but-not-yet-uploaded bytes may sit on disk.
+
+    A single file larger than the whole budget is still admitted once nothing else is held,
+    so oversized files degrade to serial processing instead of deadlocking.
+    """
+    def __init__(self, limit: int):
+        self.limit, self.used = limit, 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size: int):
+        async with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+    async def grow(self, limit: int):
+        async with self._cond:
+            self.limit = max(self.limit, limit)
+            self._cond.notify_all()
+
+class PipelineItem:
+    def __init__(self, seq: int, file: GoFileFile):
+        self.seq, self.file = seq, file
+        self.ok, self.media = False, None
+
+# Running pipelines, read by the metrics collectors for queue depths
+PIPELINES = weakref.WeakSet()
+
+class FolderPipeline:
+    """Mirrors a GoFile folder to Telegram as three overlapping stages.
+
+    download (N workers) -> probe/thumbnail (M workers) -> upload (1 worker, listing order)
+    `files` is an async iterator, so downloads start while the folder is still being listed.
+    Downloads are admitted in listing order against a ByteBudget, so the upload stage always
+    finds the next file either finished or in flight. The budget grows with the bytes
+    discovered so far, reserved from the scheduler's disk allowance.
+    """
+    def __init__(self, event, status_message, downloader: GoFileDownloader, files, job_log: JobLog = None):
+        self.event, self.status_message, self.downloader = event, status_message, downloader
+        self.job_log = job_log
+        self.files = files
+        self.listed = []
+        self.discovered_bytes = 0
+        self.successful, self.failed = 0, 0
+        self.budget = ByteBudget(0)
+        self.probe_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self.upload_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self._dispatch_lock = asyncio.Lock()
+        self._next_index = 0
+        self._uploading = None
+        self._last_update_time = time.time()
+        PIPELINES.add(self)
+
+    async def run(self):
+        async def downloads():
+            await asyncio.gather(*(self._download_stage() for _ in range(PIPELINE_DOWNLOAD_WORKERS)))
+            for _ in range(PIPELINE_PROBE_WORKERS): await self.probe_queue.put(None)
+        async def probes():
+            await asyncio.gather(*(self._probe_stage() for _ in range(PIPELINE_PROBE_WORKERS)))
+            await self.upload_queue.put(None)
+        tasks = [asyncio.ensure_future(c) for c in (downloads(), probes(), self._upload_stage())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Cancelling the stages does not stop executor threads, so tell running downloads to quit
+            self.downloader.aborted = True
+            for task in tasks: task.cancel()
+            # Wait for the stages to unwind so no worker is still inside the listing when it is closed
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.successful, self.failed
+
+    async def _download_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._dispatch_lock:
+                if (file_obj := await anext(self.files, None)) is None: return
+                item = PipelineItem(self._next_index, file_obj)
+                self._next_index += 1
+                self.listed.append(file_obj)
+                if self.job_log: self.job_log.record_file(file_obj)
+                await self._grow_budget(file_obj.size)
+                await self.budget.acquire(item.file.size)
+
+            start_time = time.time()
+            def progress_callback(downloaded, total, file_obj=item.file):
+                if self.job_log and not file_obj.segmented: self.job_log.checkpoint(file_obj, downloaded)
+                current_time = time.time()
+                # The upload stage owns the status message while it is sending a file
+                if self._uploading is None and current_time - self._last_update_time > 1.5:
+                    elapsed = current_time - start_time; speed = downloaded / elapsed if elapsed > 0 else 0
+                    percentage = (downloaded / total) * 100
+                    text = generate_progress_message("Downloading to Server", file_obj.name, percentage, downloaded, total, speed)
+                    STATUS.progress_threadsafe(loop, self.status_message, text)
+                    self._last_update_time = current_time
+
+            with METRICS.timer("gofile_download"):
+                item.ok = await loop.run_in_executor(None, self.downloader.download, item.file, progress_callback)
+            if self.job_log: self.job_log.set_state(item.file, "downloaded" if item.ok else "failed")
+            if item.ok:
+                await self.probe_queue.put(item)
+            else:
+                await self.budget.release(item.file.size)
+                await self.upload_queue.put(item)
+
+    async def _grow_budget(self, size: int):
+        self.discovered_bytes += size
+        wanted = min(self.discovered_bytes, PIPELINE_MAX_BUFFERED_BYTES)
+        if wanted > self.budget.limit:
+            # Only the first reservation may wait: blocking with space already held could deadlock two jobs
+            await self.budget.grow(await SCHEDULER.reserve_disk(wanted, wait=self.budget.limit == 0))
+
+    async def _probe_stage(self):
+        while (item := await self.probe_queue.get()) is not None:
+            item.media = await prepare_media(item.file.dest)
+            await self.upload_queue.put(item)
+
+    async def _upload_stage(self):
+        pending = {}; next_seq = 0
+        while (item := await self.upload_queue.get()) is not None:
+            pending[item.seq] = item
+            while next_seq in pending:
+                await self._finish(pending.pop(next_seq)); next_seq += 1
+
+    async def _finish(self, item: PipelineItem):
+        if not item.ok:
+            STATUS.set(self.status_message, f"⚠️ Skipping '{item.file.name}' - link may be broken.")
+            await asyncio.sleep(2)
+            self.failed += 1
+            return
+        self._uploading = item.file
+        try:
+            await upload_file_to_telegram(self.event, item.file.dest, self.status_message, media=item.media)
+            if self.job_log: self.job_log.set_state(item.file, "sent")
+            os.remove(item.file.dest)
+            with contextlib.suppress(OSError): os.rmdir(os.path.dirname(item.file.dest))
+            self.successful += 1
+        finally:
+            self._uploading = None
+            await self.budget.release(item.file.size)
+
+# =====================================================================================
+# JOB SCHEDULING
+# =====================================================================================
+
+CURRENT_JOB = contextvars.ContextVar('CURRENT_JOB', default=None)
+
+def allocated_bytes(path: str) -> int:
+    """Disk space actually allocated under a file or directory; sparse regions do not count."""
+    try:
+        if not os.path.isdir(path): return os.stat(path).st_blocks * 512
+    except OSError: return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try: total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError: pass
+    return total
+
+class Job:
+    def __init__(self, user_id: int, size: int):
+        self.user_id, self.size = user_id, size
+        self.reserved = 0
+        self.paths = set()
+        self.written = 0
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.queue_message = None
+        self.position = None
+
+class JobScheduler:
+    """Runs jobs under a global and a per-user concurrency cap.
+
+    Waiting jobs are kept in one FIFO per user and admitted round-robin across users, so one
+    user queueing many folders cannot starve the others. A job is only admitted when its
+    known size fits into free disk space (minus what running jobs have reserved but not yet
+    written); running jobs can grow their reservation later with `reserve_disk`, e.g. once a
+    folder is listed. Jobs name the files and directories they write with `track_path`; what
+    is allocated under them is measured in the executor, at most every DISK_USAGE_REFRESH_INTERVAL.
+    """
+    def __init__(self, max_jobs: int, max_jobs_per_user: int):
+        self.max_jobs, self.max_jobs_per_user = max_jobs, max_jobs_per_user
+        self.waiting = {}
+        self.running = {}
+        self.reserved_bytes = 0
+        self.active = set()
+        self._turns = deque()
+        self._disk_changed = asyncio.Condition()
+        self._measuring = None
+        self._measured_at = 0
+
+    def submit(self, event, job_factory, size: int = 0) -> asyncio.Task:
+        return asyncio.create_task(self._run(event, job_factory, Job(event.sender_id, size)))
+
+    async def _run(self, event, job_factory, job: Job):
+        queued_at = time.perf_counter()
+        self.waiting.setdefault(job.user_id, deque()).append(job)
+        if job.user_id not in self._turns: self._turns.append(job.user_id)
+        self._dispatch()
+        try:
+            if not job.admitted.done():
+                job.queue_message = await event.respond(f"⏳ Queued. Position in queue: {job.position}")
+                await asyncio.shield(job.admitted)
+            METRICS.observe("queue_wait", time.perf_counter() - queued_at)
+            if job.queue_message:
+                STATUS.discard(job.queue_message); await job.queue_message.delete()
+            CURRENT_JOB.set(job)
+            with METRICS.timer("job"):
+                await job_factory()
+        except CancelledError:
+            if not job.admitted.done() and job.queue_message: STATUS.finish(job.queue_message, "🛑 Process cancelled by user.")
+            raise
+        finally:
+            if job.admitted.done(): await self._finish(job)
+            else: self._withdraw(job)
+
+    def _free_disk(self) -> int:
+        # Jobs are admitted before any of them has written, so on a fresh start the directory may not exist yet
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        self._measure_written()
+        # Bytes a job has already written are missing from `free` and must not be subtracted again
+        written = sum(min(job.reserved, job.written) for job in self.active)
+        return shutil.disk_usage(DOWNLOAD_DIR).free - PIPELINE_DISK_RESERVE_BYTES - (self.reserved_bytes - written)
+
+    def _measure_written(self):
+        """Starts an executor walk of the running jobs' paths once the last measurement has gone stale."""
+        if self._measuring or time.monotonic() - self._measured_at < DISK_USAGE_REFRESH_INTERVAL: return
+        jobs = [(job, list(job.paths)) for job in self.active if job.paths]
+        if not jobs: return
+        measure = lambda: [(job, sum(allocated_bytes(path) for path in paths)) for job, paths in jobs]
+        self._measuring = asyncio.get_running_loop().run_in_executor(None, measure)
+        self._measuring.add_done_callback(self._measured)
+
+    def _measured(self, future):
+        self._measuring, self._measured_at = None, time.monotonic()
+        if future.cancelled() or future.exception(): return
+        for job, written in future.result(): job.written = written
+        # Written bytes only ever free up headroom, so give blocked jobs another look
+        asyncio.ensure_future(self._notify_disk_changed())
+
+    async def _notify_disk_changed(self):
+        async with self._disk_changed:
+            self._disk_changed.notify_all()
+        self._dispatch()
+
+    def track_path(self, path: str):
+        """Counts what the calling job writes under `path` against its reservation."""
+        if (job := CURRENT_JOB.get()) is not None: job.paths.add(path)
+
+    def _dispatch(self):
+        blocked = set()
+        while self._turns and sum(self.running.values()) < self.max_jobs:
+            user_id = self._turns[0]
+            if user_id in blocked: break
+            job = self.waiting[user_id][0]
+            # A job bigger than the whole disk is still let through once nothing else holds space
+            fits = job.size <= self._free_disk() or not self.reserved_bytes
+            if self.running.get(user_id, 0) >= self.max_jobs_per_user or not fits:
+                blocked.add(user_id); self._turns.rotate(-1); continue
+            self.waiting[user_id].popleft()
+            self._turns.popleft()
+            if self.waiting[user_id]: self._turns.append(user_id)
+            else: del self.waiting[user_id]
+            self.running[user_id] = self.running.get(user_id, 0) + 1
+            self.reserved_bytes += job.size; job.reserved = job.size
+            self.active.add(job)
+            job.admitted.set_result(True)
+        self._announce_positions()
+
+    def _announce_positions(self):
+        queues = {user_id: list(self.waiting[user_id]) for user_id in self._turns}
+        position = 0
+        while any(queues.values()):
+            for user_id in self._turns:
+                if not queues[user_id]: continue
+                job = queues[user_id].pop(0); position += 1
+                if job.position != position:
+                    job.position = position
+                    if job.queue_message: STATUS.progress(job.queue_message, f"⏳ Queued. Position in queue: {position}")
+
+    def _withdraw(self, job: Job):
+        if job in self.waiting.get(job.user_id, ()):
+            self.waiting[job.user_id].remove(job)
+            if not self.waiting[job.user_id]:
+                del self.waiting[job.user_id]; self._turns.remove(job.user_id)
+        self._dispatch()
+
+    async def _finish(self, job: Job):
+        self.running[job.user_id] -= 1
+        if not self.running[job.user_id]: del self.running[job.user_id]
+        self.active.discard(job)
+        async with self._disk_changed:
+            self.reserved_bytes -= job.reserved; job.reserved = 0
+            self._disk_changed.notify_all()
+        self._dispatch()
+
+    async def reserve_disk(self, nbytes: int, wait: bool = True) -> int:
+        """Grows the calling job's disk reservation towards `nbytes` and returns the total granted.
+
+        With `wait` the call blocks until the whole amount fits (or no other job holds space);
+        without it the job gets whatever is free right now.
+        """
+        job = CURRENT_JOB.get()
+        if job is None: return max(0, min(nbytes, self._free_disk()))
+        async with self._disk_changed:
+            if wait: await self._disk_changed.wait_for(lambda: nbytes - job.reserved <= self._free_disk() or self.reserved_bytes == job.reserved)
+            granted = max(job.reserved, min(nbytes, job.reserved + self._free_disk()))
+            self.reserved_bytes += granted - job.reserved; job.reserved = granted
+        return granted
+
+SCHEDULER = JobScheduler(MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER)
+
+# =====================================================================================
+# PARALLEL TELEGRAM TRANSFERS
+# =====================================================================================
+
+class ParallelTransferrer:
+    """Moves one Telegram file as concurrent part requests spread over several MTProto senders.
+
+    download_media and send_file move one part at a time over the client's main connection.
+    Here every worker owns its own sender to the file's DC and keeps one part request in
+    flight, so throughput scales with `workers` until the link or Telegram's per-connection
+    cap is hit. A foreign DC is authorized once (export + import) and its auth key is reused
+    by every later sender and transfer to that DC until Telegram stops accepting it.
+    `sender_factory` replaces the real connections, e.g. with the benchmark's fake part server.
+    """
+    # Auth keys imported into foreign DCs, and the locks that keep each DC to one import at a time
+    _dc_auth_keys = {}
+    _dc_locks = {}
+
+    def __init__(self, client, dc_id: int = None, workers: int = TELEGRAM_TRANSFER_WORKERS, sender_factory=None):
+        self.client = client
+        self.dc_id = dc_id or client.session.dc_id
+        self.workers = max(1, workers)
+        self._sender_factory = sender_factory or self._create_sender
+
+    @property
+    def home_dc(self) -> bool:
+        return self.dc_id == self.client.session.dc_id
+
+    async def _create_sender(self):
+        dc = await self.client._get_dc(self.dc_id)
+        connection = lambda: self.client._connection(dc.ip_address, dc.port, dc.id, loggers=self.client._log, proxy=self.client._proxy)
+        auth_key = self.client.session.auth_key if self.home_dc else self._dc_auth_keys.get(self.dc_id)
+        if auth_key is None:
+            async with self._dc_locks.setdefault(self.dc_id, asyncio.Lock()):
+                if (auth_key := self._dc_auth_keys.get(self.dc_id)) is None:
+                    sender = MTProtoSender(None, loggers=self.client._log)
+                    await sender.connect(connection())
+                    auth = await self.client(ExportAuthorizationRequest(self.dc_id))
+                    # A copy, so concurrent imports into other DCs never see each other's query
+                    init_request = copy.copy(self.client._init_request)
+                    init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                    await sender.send(InvokeWithLayerRequest(LAYER, init_request))
+                    self._dc_auth_keys[self.dc_id] = sender.auth_key
+                    return sender
+        sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await sender.connect(connection())
+        return sender
+
+    async def _open_senders(self, count: int) -> list:
+        return list(await asyncio.gather(*(self._sender_factory() for _ in range(count))))
+
+    async def _close_senders(self, senders: list):
+        for sender in senders:
+            try: await sender.disconnect()
+            except Exception as e: logger.debug(f"Closing transfer sender failed: {e}")
+
+    async def _send(self, sender, request):
+        for attempt in range(TELEGRAM_PART_RETRIES + 1):
+            try:
+                return await sender.send(request)
+            except AuthKeyUnregisteredError:
+                # The DC forgot our imported key; the next sender exports and imports a fresh one
+                if not self.home_dc: self._dc_auth_keys.pop(self.dc_id, None)
+                raise
+            except FloodWaitError as e:
+                if attempt == TELEGRAM_PART_RETRIES: raise
+                await asyncio.sleep(e.seconds)
+            except (ConnectionError, asyncio.TimeoutError):
+                if attempt == TELEGRAM_PART_RETRIES: raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def download(self, location, file_size: int, part_size: int = TELEGRAM_PART_SIZE):
+        """Yields the file's bytes part by part, in order, while up to 2x`workers` parts are fetched ahead."""
+        part_count = math.ceil(file_size / part_size)
+        if not part_count: return
+        loop = asyncio.get_running_loop()
+        parts = {index: loop.create_future() for index in range(part_count)}
+        window = asyncio.Semaphore(self.workers * 2)
+        next_part = 0
+
+        async def worker(sender):
+            nonlocal next_part
+            while True:
+                await window.acquire()
+                if next_part >= part_count: window.release(); return
+                index = next_part; next_part += 1
+                try:
+                    result = await self._send(sender, GetFileRequest(location, offset=index * part_size, limit=part_size))
+                    parts[index].set_result(result.bytes)
+                except Exception as e:
+                    parts[index].set_exception(e); return
+
+        senders = await self._open_senders(min(self.workers, part_count))
+        tasks = [asyncio.ensure_future(worker(sender)) for sender in senders]
+        try:
+            for index in range(part_count):
+                data = await parts[index]
+                del parts[index]
+                window.release()
+                yield data
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for future in parts.values():
+                # Silence "exception was never retrieved" for parts nobody will read now
+                if future.done() and not future.cancelled(): future.exception()
+            await self._close_senders(senders)
+
+    async def upload(self, filepath: str, progress_callback=None, part_size: int = TELEGRAM_PART_SIZE):
+        """Uploads a local file part-parallel and returns the InputFile/InputFileBig to pass to send_file."""
+        file_size = os.path.getsize(filepath)
+        part_count = max(1, math.ceil(file_size / part_size))
+        is_big = file_size > 10 * 1024**2
+        file_id = helpers.generate_random_long()
+        loop = asyncio.get_running_loop()
+        uploaded, next_part = 0, 0
+        reads = set()
+
+        async def worker(sender, fd):
+            nonlocal uploaded, next_part
+            while next_part < part_count:
+                index = next_part; next_part += 1
+                # Shielded so a cancelled worker leaves the read tracked until its thread is done with fd
+                read = loop.run_in_executor(None, os.pread, fd, part_size, index * part_size)
+                reads.add(read); read.add_done_callback(reads.discard)
+                data = await asyncio.shield(read)
+                if is_big: request = SaveBigFilePartRequest(file_id, index, part_count, data)
+                else: request = SaveFilePartRequest(file_id, index, data)
+                if not await self._send(sender, request): raise Exception(f"Telegram rejected part {index} of {filepath}")
+                uploaded += len(data)
+                if progress_callback:
+                    result = progress_callback(uploaded, file_size)
+                    if inspect.isawaitable(result): await result
+
+        senders = await self._open_senders(min(self.workers, part_count))
+        fd = os.open(filepath, os.O_RDONLY)
+        tasks = [asyncio.ensure_future(worker(sender, fd)) for sender in senders]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # gather leaves the other workers running when one part fails; stop them and let
+            # any in-flight read finish before the fd and the senders go away
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if reads: await asyncio.wait(reads)
+            os.close(fd)
+            await self._close_senders(senders)
+        name = os.path.basename(filepath)
+        if is_big: return InputFileBig(file_id, part_count, name)
+        md5 = await loop.run_in_executor(None, lambda: hash_file(filepath, hashlib.md5).hexdigest())
+        return InputFile(file_id, part_count, name, md5)
+
+def parallel_transfer_enabled(size: int) -> bool:
+    return TELEGRAM_TRANSFER_WORKERS > 1 and (size or 0) >= TELEGRAM_PARALLEL_MIN_SIZE
+
+async def iter_telegram_download(message, request_size: int = TELEGRAM_PART_SIZE):
+    """Async iterator over a message's media bytes, part-parallel for large files."""
+    if parallel_transfer_enabled(message.file.size):
+        dc_id, location = utils.get_input_location(message.media)
+        async for chunk in ParallelTransferrer(message.client, dc_id).download(location, message.file.size, request_size):
+            METRICS.add_bytes("telegram_download", len(chunk))
+            yield chunk
+    else:
+        async for chunk in message.client.iter_download(message.media, request_size=request_size):
+            METRICS.add_bytes("telegram_download", len(chunk))
+            yield chunk
 
 # =====================================================================================
 # TELEGRAM BOT LOGIC
@@ -160,28 +1489,169 @@ def generate_progress_message(action: str, filename: str, progress: float, trans
     bar = '█' * filled_length + '░' * (bar_length - filled_length)
     return (f"**{action}**\n**File:** `{filename}`\n`{bar}`\n`{format_bytes(transferred)} / {format_bytes(total)}`\n`Speed: {format_bytes(speed)}/s`")
 
-async def generate_thumbnail(video_path: str) -> str | None:
-    thumb_path = video_path + ".jpg"
-    try:
-        process = await asyncio.create_subprocess_exec('ffmpeg', '-i', video_path, '-ss', '00:00:01.000', '-vframes', '1', '-y', thumb_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        _, stderr = await process.communicate()
-        if process.returncode != 0:
-            logger.error(f"ffmpeg thumb failed: {stderr.decode()}"); return None
-        return thumb_path
-    except FileNotFoundError: return None
-    except Exception as e: logger.error(f"Thumb generation failed: {e}"); return None
-
-async def get_video_attributes(video_path: str):
-    try:
-        process = await asyncio.create_subprocess_exec('ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', video_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        stdout, _ = await process.communicate()
-        if process.returncode != 0: return []
-        data = json.loads(stdout)
-        video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
-        if video_stream:
-            return [DocumentAttributeVideo(duration=int(float(video_stream.get('duration', 0))), w=int(video_stream.get('width', 0)), h=int(video_stream.get('height', 0)), supports_streaming=True)]
-    except Exception as e: logger.error(f"Failed to get video attributes: {e}")
-    return []
+class StatusUpdater:
+    """The single writer of status-message edits.
+
+    `progress` records the latest text for a message and returns at once; older pending
+    progress for the same message is simply replaced. `set` queues text that progress may
+    not overwrite until it has been sent (stage changes); `finish` does the same for a final
+    result, error or cancellation and drops everything queued for the message after it. A background task
+    sends edits no faster than STATUS_EDITS_PER_SECOND overall and STATUS_MIN_INTERVAL per
+    message, skips text identical to what the message already shows, and pauses for the
+    whole FloodWaitError duration, so none of this ever blocks a transfer.
+    """
+    def __init__(self, edits_per_second: float = STATUS_EDITS_PER_SECOND, min_interval: float = STATUS_MIN_INTERVAL):
+        self.edit_interval, self.min_interval = 1 / edits_per_second, min_interval
+        self._pending = {}
+        self._shown = {}
+        self._finished = {}
+        self._last_edit_at = 0.0
+        self._blocked_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = {"edits": 0, "coalesced": 0, "unchanged": 0, "flood_waits": 0}
+
+    def _queue(self, message, text: str, sticky: bool):
+        key = (message.chat_id, message.id)
+        if key in self._finished: return
+        if (pending := self._pending.get(key)):
+            if pending[2] and not sticky: return
+            self.stats["coalesced"] += 1
+        self._pending[key] = (message, text, sticky)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        self._wakeup.set()
+
+    def progress(self, message, text: str):
+        self._queue(message, text, sticky=False)
+
+    def progress_threadsafe(self, loop, message, text: str):
+        loop.call_soon_threadsafe(self._queue, message, text, False)
+
+    def set(self, message, text: str):
+        self._queue(message, text, sticky=True)
+
+    def finish(self, message, text: str):
+        """Sets the message's final text (result, error, cancellation); anything queued for it later is dropped."""
+        self._queue(message, text, sticky=True)
+        self._finished[(message.chat_id, message.id)] = time.monotonic()
+
+    def discard(self, message):
+        """Drops pending edits, e.g. right before the message is deleted."""
+        for state in (self._pending, self._shown, self._finished): state.pop((message.chat_id, message.id), None)
+
+    def _ready_at(self, key, sticky: bool) -> float:
+        if sticky or key not in self._shown: return 0.0
+        return self._shown[key][1] + self.min_interval
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._pending:
+                await self._wakeup.wait(); continue
+            now = time.monotonic()
+            key = min(self._pending, key=lambda k: self._ready_at(k, self._pending[k][2]))
+            start_at = max(self._ready_at(key, self._pending[key][2]), self._last_edit_at + self.edit_interval, self._blocked_until)
+            if start_at > now:
+                try: await asyncio.wait_for(self._wakeup.wait(), start_at - now)
+                except asyncio.TimeoutError: pass
+                continue
+            message, text, sticky = self._pending.pop(key)
+            if self._shown.get(key, (None,))[0] == text:
+                self.stats["unchanged"] += 1; continue
+            self._last_edit_at = time.monotonic()
+            try:
+                await message.edit(text)
+                self._shown[key] = (text, self._last_edit_at)
+                self.stats["edits"] += 1
+            except FloodWaitError as e:
+                self.stats["flood_waits"] += 1
+                logger.warning(f"Status edits hit a flood wait, pausing them for {e.seconds}s")
+                self._blocked_until = time.monotonic() + e.seconds
+                if key not in self._pending or (sticky and not self._pending[key][2]): self._pending[key] = (message, text, sticky)
+            except MessageNotModifiedError:
+                self._shown[key] = (text, self._last_edit_at)
+            except Exception as e:
+                logger.debug(f"Status edit failed: {e}")
+            if len(self._shown) > 1000 or len(self._finished) > 1000:
+                cutoff = time.monotonic() - 3600
+                self._shown = {k: v for k, v in self._shown.items() if v[1] > cutoff}
+                self._finished = {k: at for k, at in self._finished.items() if at > cutoff}
+
+STATUS = StatusUpdater()
+
+FFMPEG_DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+FFMPEG_VIDEO_SIZE = re.compile(r'Video: .*?, (\d{2,5})x(\d{2,5})')
+FFMPEG_ROTATION = re.compile(r'rotation of (-?\d+(?:\.\d+)?) degrees')
+
+def is_video(filename: str) -> bool:
+    if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS: return True
+    return (mimetypes.guess_type(filename)[0] or '').startswith('video/')
+
+def parse_ffmpeg_input(stderr: str) -> dict:
+    """Reads duration and display size of the first real video stream from ffmpeg's input summary."""
+    info = {}
+    for line in stderr.split('Output #0')[0].split('Stream mapping')[0].splitlines():
+        if 'width' not in info and (match := FFMPEG_DURATION.search(line)):
+            hours, minutes, seconds = match.groups()
+            info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        elif 'width' not in info and 'attached pic' not in line and (match := FFMPEG_VIDEO_SIZE.search(line)):
+            info['width'], info['height'] = int(match[1]), int(match[2])
+        elif 'width' in info and 'rotation' not in info and (match := FFMPEG_ROTATION.search(line)):
+            info['rotation'] = float(match[1])
+            if abs(info['rotation']) % 180 == 90: info['width'], info['height'] = info['height'], info['width']
+    return info if 'width' in info else {}
+
+class MediaProber:
+    """Reads video metadata and a thumbnail with a single ffmpeg run per file.
+
+    ffmpeg seeks on the input (-ss before -i), so only the packets around the thumbnail
+    frame are decoded, and the input summary it prints already carries the duration and
+    frame size, so no separate ffprobe pass is needed. Results are cached by file identity
+    and concurrent requests for one file share a run; at most `processes` ffmpeg processes
+    run at once across all jobs.
+    """
+    def __init__(self, processes: int = MEDIA_PROBE_PROCESSES, cache_size: int = MEDIA_PROBE_CACHE_SIZE):
+        self._slots = asyncio.Semaphore(processes)
+        self.cache_size = cache_size
+        self._cache = {}
+        self.stats = {"runs": 0, "hits": 0}
+
+    async def probe(self, path: str) -> tuple[dict, bytes | None]:
+        """Returns ({duration, width, height}, jpeg bytes); both are empty when the file has no video."""
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        if (future := self._cache.pop(key, None)) is not None: self.stats["hits"] += 1
+        else: future = asyncio.ensure_future(self._probe(path))
+        self._cache[key] = future
+        while len(self._cache) > self.cache_size: self._cache.pop(next(iter(self._cache)))
+        try: return await asyncio.shield(future)
+        except CancelledError: raise
+        except Exception as e:
+            self._cache.pop(key, None)
+            logger.error(f"Media probe of {os.path.basename(path)} failed: {e}"); return {}, None
+
+    async def _probe(self, path: str):
+        async with self._slots:
+            info, thumb = await self._run_ffmpeg(path, THUMBNAIL_SEEK_SECONDS)
+            # Clips shorter than the seek offset have no frame there, so take the first one
+            if info and not thumb and info.get('duration', 0) <= THUMBNAIL_SEEK_SECONDS:
+                _, thumb = await self._run_ffmpeg(path, 0)
+        return info, thumb
+
+    async def _run_ffmpeg(self, path: str, seek: float):
+        self.stats["runs"] += 1
+        args = ['ffmpeg', '-hide_banner', '-nostdin', '-ss', str(seek), '-i', path, '-map', '0:V:0?', '-frames:v', '1',
+                '-vf', f"scale='min({THUMBNAIL_WIDTH},iw)':-2", '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '4', 'pipe:1']
+        try:
+            process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError: return {}, None
+        with METRICS.timer("media_probe"):
+            stdout, stderr = await process.communicate()
+        # The input summary is printed even when no frame could be written
+        return parse_ffmpeg_input(stderr.decode(errors='replace')), (stdout if process.returncode == 0 and stdout else None)
+
+MEDIA_PROBER = MediaProber()
 
 @client.on(events.NewMessage(pattern='/start'))
 async def start(event):
@@ -195,71 +1665,68 @@ async def start(event):
 
 @client.on(events.NewMessage(pattern='/stop'))
 async def stop_handler(event):
-    if (task := USER_TASKS.get(event.sender_id)): task.cancel()
+    if (tasks := USER_TASKS.get(event.sender_id)):
+        for task in list(tasks): task.cancel()
     else: await event.respond("You have no active process to stop.")
 
 @client.on(events.NewMessage)
 async def message_handler(event):
     if not event.is_private or event.text.startswith('/'): return
-    if event.sender_id in USER_TASKS:
-        await event.respond("You already have a process running. Please wait or use /stop."); return
-    task = None
+    task = None; user_id = event.sender_id
     if event.message.text:
         url = event.message.text
-        if 'gofile.io/d/' in url or 'gofile.io/c/' in url: task = asyncio.create_task(process_gofile_folder(event, url))
-        elif url.startswith(('http://', 'https://')): task = asyncio.create_task(upload_from_link(event, url))
-    elif event.message.file: task = asyncio.create_task(handle_file_upload(event))
-    if task:
-        USER_TASKS[event.sender_id] = task
-        task.add_done_callback(lambda t: USER_TASKS.pop(event.sender_id, None))
-
-async def process_gofile_folder(event, url):
-    status_message = await event.respond(f"✅ Link received. Inspecting folder...")
+        if 'gofile.io/d/' in url or 'gofile.io/c/' in url: task = SCHEDULER.submit(event, lambda: process_gofile_folder(event, url))
+        elif url.startswith(('http://', 'https://')): task = SCHEDULER.submit(event, lambda: upload_from_link(event, url))
+    elif event.message.file:
+        size = 0 if RELAY_STREAMING else (event.message.file.size or 0)
+        task = SCHEDULER.submit(event, lambda: handle_file_upload(event), size)
+    if task: track_user_task(user_id, task)
+
+def track_user_task(user_id, task):
+    USER_TASKS.setdefault(user_id, set()).add(task)
+    def forget(t):
+        USER_TASKS[user_id].discard(t)
+        if not USER_TASKS[user_id]: del USER_TASKS[user_id]
+    task.add_done_callback(forget)
+
+async def process_gofile_folder(event, url, resumed=False):
+    status_message = await event.respond("♻️ Bot restarted. Resuming folder job..." if resumed else "✅ Link received. Inspecting folder...")
     temp_download_path = os.path.join(DOWNLOAD_DIR, f"gofile_{event.message.id}")
     os.makedirs(temp_download_path, exist_ok=True)
+    SCHEDULER.track_path(temp_download_path)
+    job_id = f"{event.chat_id}_{event.message.id}"
+    job_log = JOURNAL.start_job(job_id, event.sender_id, event.chat_id, event.message.id, url, temp_download_path)
+    # Only a finished, failed or user-stopped job is cleaned up; if the process dies mid-job the
+    # files and journal stay behind so the next start can resume it
+    finished = False
     try:
         loop = asyncio.get_event_loop()
         gofile_engine = GoFile()
         content_id = os.path.basename(urlparse(url).path)
         
-        files_to_process = await loop.run_in_executor(None, gofile_engine.get_folder_contents, content_id, temp_download_path)
-        if not files_to_process: raise Exception("No files found in the folder.")
+        STATUS.set(status_message, "✅ Listing folder. Downloads start as soon as files are found...")
+        await loop.run_in_executor(None, gofile_engine._update_session)
         
-        await status_message.edit(f"✅ Found {len(files_to_process)} file(s). Starting download process...")
-        
-        downloader = GoFileDownloader(token=gofile_engine.token)
-        successful_downloads = 0
-        failed_downloads = 0
-        
-        for i, file_obj in enumerate(files_to_process):
-            if i > 0:
-                await status_message.edit(f"🔄 Refreshing download links...")
-                await loop.run_in_executor(None, gofile_engine.refresh_folder_links, content_id, files_to_process)
-                await asyncio.sleep(1)
-            
-            last_update_time = time.time(); start_time = time.time()
-            def progress_callback(downloaded, total):
-                nonlocal last_update_time, start_time
-                current_time = time.time()
-                if current_time - last_update_time > 1.5:
-                    elapsed = current_time - start_time; speed = downloaded / elapsed if elapsed > 0 else 0
-                    percentage = (downloaded / total) * 100
-                    text = generate_progress_message("Downloading to Server", file_obj.name, percentage, downloaded, total, speed)
-                    asyncio.run_coroutine_threadsafe(status_message.edit(text), loop)
-                    last_update_time = current_time
-            
-            download_success = await loop.run_in_executor(None, downloader.download, file_obj, progress_callback)
-            
-            if download_success:
-                await upload_file_to_telegram(event, file_obj.dest, status_message)
-                os.remove(file_obj.dest)
-                successful_downloads += 1
-            else:
-                await status_message.edit(f"⚠️ Skipping '{file_obj.name}' - link may be broken.")
-                await asyncio.sleep(2)
-                failed_downloads += 1
+        downloader = GoFileDownloader(link_cache=gofile_engine.link_cache)
+        states = await loop.run_in_executor(None, job_log.states)
+        already_sent = 0
+        async def unsent_files():
+            nonlocal already_sent
+            async with contextlib.aclosing(gofile_engine.iter_folder_contents(content_id, temp_download_path)) as listing:
+                async for file_obj in listing:
+                    if states.get(file_obj.id) == "sent": already_sent += 1
+                    else: yield file_obj
+        files = unsent_files()
+        try:
+            pipeline = FolderPipeline(event, status_message, downloader, files, job_log)
+            successful_downloads, failed_downloads = await pipeline.run()
+        finally:
+            await files.aclose()
+        if not pipeline.listed and not already_sent: raise Exception("No files found in the folder.")
+        successful_downloads += already_sent
             
-        await status_message.delete()
+        finished = True
+        STATUS.discard(status_message); await status_message.delete()
         
         if successful_downloads > 0:
             summary_msg = f"✅ Process completed!\n\n📥 **Successfully sent:** {successful_downloads} file(s)"
@@ -269,53 +1736,89 @@ async def process_gofile_folder(event, url):
         else:
             await event.respond("❌ No files could be downloaded. All links appear to be broken.")
             
-    except CancelledError: await status_message.edit("🛑 Process cancelled by user.")
-    except Exception as e: await status_message.edit(f"❌ An error occurred: {e}")
+    except CancelledError:
+        finished = True; STATUS.finish(status_message, "🛑 Process cancelled by user.")
+    except Exception as e:
+        finished = True; STATUS.finish(status_message, f"❌ An error occurred: {e}")
     finally:
-        if os.path.exists(temp_download_path): shutil.rmtree(temp_download_path)
+        if finished:
+            JOURNAL.finish_job(job_id)
+            if os.path.exists(temp_download_path): shutil.rmtree(temp_download_path)
+
+class ResumedEvent:
+    """Stands in for the NewMessage event of a journaled job when it is resumed after a restart."""
+    def __init__(self, client, user_id: int, chat_id: int, message_id: int):
+        self.client, self.sender_id, self.chat_id = client, user_id, chat_id
+        self.message = types.SimpleNamespace(id=message_id)
+
+    async def respond(self, text):
+        return await self.client.send_message(self.chat_id, text)
 
-async def upload_file_to_telegram(event, filepath, status_message):
-    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0: return
+async def resume_unfinished_jobs():
+    for job_id, user_id, chat_id, message_id, url, temp_dir in JOURNAL.unfinished_jobs():
+        logger.info(f"Resuming folder job {job_id} for user {user_id}")
+        JOURNAL.restore_checkpoints(job_id)
+        event = ResumedEvent(client, user_id, chat_id, message_id)
+        track_user_task(user_id, SCHEDULER.submit(event, lambda event=event, url=url: process_gofile_folder(event, url, resumed=True)))
+
+async def prepare_media(filepath):
     filename = os.path.basename(filepath)
-    file_extension = os.path.splitext(filename)[1].lower()
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov']
-    is_video = file_extension in video_extensions
-    
-    thumb_path = None
     attributes = [DocumentAttributeFilename(filename)]
+    thumb_path = None
+    if is_video(filename):
+        info, thumb = await MEDIA_PROBER.probe(filepath)
+        if info:
+            attributes.append(DocumentAttributeVideo(duration=int(info.get('duration', 0)), w=info['width'], h=info['height'], supports_streaming=True))
+        if thumb:
+            # A unique name, so a sibling file that happens to be called '<video>.jpg' is never overwritten
+            fd, thumb_path = tempfile.mkstemp(suffix=".jpg", dir=os.path.dirname(filepath))
+            with os.fdopen(fd, 'wb') as f: f.write(thumb)
+    return thumb_path, attributes
+
+async def upload_file_to_telegram(event, filepath, status_message, media=None):
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        if media and media[0] and os.path.exists(media[0]): os.remove(media[0])
+        return
+    filename = os.path.basename(filepath)
+    thumb_path = media[0] if media else None
 
     try:
-        if is_video:
-            thumb_path = await generate_thumbnail(filepath)
-            video_meta_attrs = await get_video_attributes(filepath)
-            attributes.extend(video_meta_attrs)
+        thumb_path, attributes = media if media else await prepare_media(filepath)
 
-        await status_message.edit(f"Uploading `{filename}`...")
-        last_update_time = time.time(); start_time = time.time()
+        STATUS.set(status_message, f"Uploading `{filename}`...")
+        last_update_time = time.time(); start_time = time.time(); counted = 0
         async def progress_callback(uploaded, total):
-            nonlocal last_update_time, start_time
+            nonlocal last_update_time, start_time, counted
+            # A single-connection retry after a failed parallel upload starts counting from zero again
+            METRICS.add_bytes("telegram_upload", uploaded - counted if uploaded >= counted else uploaded); counted = uploaded
             current_time = time.time()
             if current_time - last_update_time > 1.5:
                 elapsed = current_time - start_time; speed = uploaded / elapsed if elapsed > 0 else 0
                 percentage = (uploaded / total) * 100
                 text = generate_progress_message("Uploading to You", filename, percentage, uploaded, total, speed)
-                try: await status_message.edit(text)
-                except Exception: pass
+                STATUS.progress(status_message, text)
                 last_update_time = current_time
         
-        await event.client.send_file(
-            event.chat_id,
-            file=filepath,
-            thumb=thumb_path,
-            progress_callback=progress_callback,
-            force_document=False,
-            attributes=attributes
-        )
+        file = filepath
+        with METRICS.timer("telegram_upload"):
+            if parallel_transfer_enabled(os.path.getsize(filepath)):
+                try:
+                    file = await ParallelTransferrer(event.client).upload(filepath, progress_callback)
+                except CancelledError: raise
+                except Exception as e: logger.warning(f"Parallel upload of {filename} failed, retrying with one connection: {e}")
+            await event.client.send_file(
+                event.chat_id,
+                file=file,
+                thumb=thumb_path,
+                progress_callback=progress_callback,
+                force_document=False,
+                attributes=attributes
+            )
     finally:
         if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
 
 async def handle_file_upload(event):
-    status_message = None; filepath = None
+    status_message = None; job_dir = None
     try:
         message = event.message
         if message.file.name: filename = message.file.name
@@ -323,17 +1826,34 @@ async def handle_file_upload(event):
             ext = message.file.mime_type.split('/')[-1] if message.file.mime_type else 'dat'
             filename = f"telegram_file_{message.id}.{ext}"
         status_message = await event.respond(f"📄 Received '{filename}'. Preparing to download...")
-        filepath = os.path.join(DOWNLOAD_DIR, filename)
+        keys = [telegram_media_key(message)]
+        if await answer_from_index(keys, status_message): return
+        if RELAY_STREAMING and message.file.size:
+            # Telegram downloads can always be restarted, so a failed relay is retried through disk
+            try:
+                hasher = hashlib.sha256()
+                download_page = await relay_to_gofile(iter_telegram_download(message), filename, message.file.size, status_message, hasher=hasher)
+                await asyncio.get_running_loop().run_in_executor(None, DEDUP_INDEX.remember, keys + [content_key(hasher)], download_page)
+                return
+            except CancelledError: raise
+            except Exception as e:
+                logger.warning(f"Relay of {filename} failed, falling back to disk: {e}")
+                STATUS.set(status_message, "⚠️ Streaming relay failed. Retrying through disk...")
         if not os.path.exists(DOWNLOAD_DIR): os.makedirs(DOWNLOAD_DIR)
+        # A directory per job, so concurrent jobs for files with the same name never share a path
+        job_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        filepath = os.path.join(job_dir, filename)
+        # Relayed files are admitted without a reservation; the disk fallback needs one like any other download
+        await SCHEDULER.reserve_disk(message.file.size or 0)
+        SCHEDULER.track_path(job_dir)
         await download_from_telegram(message, filepath, status_message)
         if not os.path.exists(filepath) or os.path.getsize(filepath) == 0: raise FileNotFoundError("File empty after download.")
-        await status_message.edit("✅ TG download complete. Preparing to upload to GoFile...")
-        await upload_to_gofile(filepath, filename, status_message)
-    except CancelledError: await status_message.edit("🛑 Process cancelled by user.")
+        await upload_new_content(filepath, filename, status_message, keys, "✅ TG download complete. Preparing to upload to GoFile...")
+    except CancelledError: STATUS.finish(status_message, "🛑 Process cancelled by user.")
     except Exception as e:
-        if status_message: await status_message.edit(f"❌ An error occurred: {e}")
+        if status_message: STATUS.finish(status_message, f"❌ An error occurred: {e}")
     finally:
-        if filepath and os.path.exists(filepath): os.remove(filepath)
+        if job_dir: shutil.rmtree(job_dir, ignore_errors=True)
 
 async def download_from_telegram(message, filepath, status_message):
     last_update_time = time.time(); start_time = time.time()
@@ -344,51 +1864,195 @@ async def download_from_telegram(message, filepath, status_message):
             elapsed = current_time - start_time; speed = downloaded / elapsed if elapsed > 0 else 0
             percentage = (downloaded / total) * 100
             text = generate_progress_message("Downloading from Telegram", os.path.basename(filepath), percentage, downloaded, total, speed)
-            await status_message.edit(text)
+            STATUS.progress(status_message, text)
             last_update_time = current_time
-    await message.download_media(file=filepath, progress_callback=progress_callback)
+    with METRICS.timer("telegram_download"):
+        if parallel_transfer_enabled(message.file.size):
+            try:
+                downloaded = 0
+                with open(filepath, 'wb') as f:
+                    async for chunk in iter_telegram_download(message):
+                        f.write(chunk); downloaded += len(chunk)
+                        await progress_callback(downloaded, message.file.size)
+                return
+            except CancelledError: raise
+            except Exception as e: logger.warning(f"Parallel download of {os.path.basename(filepath)} failed, retrying with one connection: {e}")
+        counted = 0
+        async def count_progress(downloaded, total):
+            nonlocal counted
+            METRICS.add_bytes("telegram_download", downloaded - counted); counted = downloaded
+            await progress_callback(downloaded, total)
+        await message.download_media(file=filepath, progress_callback=count_progress)
+
+async def upload_new_content(filepath, filename, status_message, keys, ready_text):
+    """Uploads a downloaded file unless identical bytes already went to GoFile, and indexes the result under all keys."""
+    keys = keys + [content_key(await asyncio.get_running_loop().run_in_executor(None, hash_file, filepath))]
+    if not (download_page := await answer_from_index(keys[-1:], status_message)):
+        STATUS.set(status_message, ready_text)
+        download_page = await upload_to_gofile(filepath, filename, status_message)
+    await asyncio.get_running_loop().run_in_executor(None, DEDUP_INDEX.remember, keys, download_page)
+
+async def link_key(url) -> str | None:
+    try:
+        response = await asyncio.get_running_loop().run_in_executor(None, lambda: requests.head(url, allow_redirects=True, timeout=15))
+        return url_key(url, response.headers) if response.ok else None
+    except requests.exceptions.RequestException: return None
 
 async def upload_from_link(event, url):
     status_message = await event.respond(f"🔗 Received link. Preparing to download...")
-    filepath = None
+    job_dir = None
     try:
         if not os.path.exists(DOWNLOAD_DIR): os.makedirs(DOWNLOAD_DIR)
         filename = url.split('/')[-1].split('?')[0] or "downloaded_file"
-        filepath = os.path.join(DOWNLOAD_DIR, filename)
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(filepath, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192): f.write(chunk)
+        keys = [await link_key(url)]
+        if await answer_from_index(keys, status_message): return
+        if RELAY_STREAMING:
+            try:
+                if await relay_link_to_gofile(url, filename, status_message, keys): return
+            except CancelledError: raise
+            except Exception as e:
+                logger.warning(f"Relay of {url} failed, falling back to disk: {e}")
+                STATUS.set(status_message, "⚠️ Streaming relay failed. Retrying through disk...")
+        job_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        filepath = os.path.join(job_dir, filename)
+        SCHEDULER.track_path(job_dir)
+        def download_link():
+            with requests.get(url, stream=True, timeout=30) as r:
+                r.raise_for_status()
+                with open(filepath, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=8192):
+                        f.write(chunk); METRICS.add_bytes("link_download", len(chunk))
+        with METRICS.timer("link_download"):
+            await asyncio.get_running_loop().run_in_executor(None, download_link)
         if not os.path.exists(filepath) or os.path.getsize(filepath) == 0: raise FileNotFoundError("File empty after download.")
-        await status_message.edit("✅ Download complete. Preparing to upload to GoFile...")
-        await upload_to_gofile(filepath, filename, status_message)
-    except CancelledError: await status_message.edit("🛑 Process cancelled by user.")
+        await upload_new_content(filepath, filename, status_message, keys, "✅ Download complete. Preparing to upload to GoFile...")
+    except CancelledError: STATUS.finish(status_message, "🛑 Process cancelled by user.")
     except Exception as e:
-        if status_message: await status_message.edit(f"❌ An error occurred: {e}")
+        if status_message: STATUS.finish(status_message, f"❌ An error occurred: {e}")
     finally:
-        if filepath and os.path.exists(filepath): os.remove(filepath)
+        if job_dir: shutil.rmtree(job_dir, ignore_errors=True)
 
-async def upload_to_gofile(filepath, filename, status_message):
-    server_response = requests.get("https://api.gofile.io/servers")
-    server_response.raise_for_status()
-    server = server_response.json()["data"]["servers"][0]["name"]
+async def stream_to_gofile(source, filename, size, status_message, action="Uploading to GoFile", hasher=None) -> str:
+    loop = asyncio.get_running_loop()
+    server = (await loop.run_in_executor(None, GOFILE_CLIENT.servers))[0]
     upload_url = f"https://{server}.gofile.io/uploadFile"
-    with open(filepath, 'rb') as f:
-        files = {'file': (filename, f)}
-        headers = {"Authorization": f"Bearer {GOFILE_TOKEN}"}
-        response = requests.post(upload_url, headers=headers, files=files)
-    response.raise_for_status()
+    last_update_time = time.time(); start_time = time.time()
+    def progress_callback(uploaded, total):
+        nonlocal last_update_time
+        current_time = time.time()
+        if current_time - last_update_time > 1.5:
+            elapsed = current_time - start_time; speed = uploaded / elapsed if elapsed > 0 else 0
+            percentage = (uploaded / total) * 100 if total else 100
+            text = generate_progress_message(action, filename, percentage, uploaded, total, speed)
+            STATUS.progress_threadsafe(loop, status_message, text)
+            last_update_time = current_time
+    body = MultipartFileStream(source, filename, size, progress_callback=progress_callback, hasher=hasher)
+    headers = {"Authorization": f"Bearer {GOFILE_TOKEN}", "Content-Type": body.content_type}
+    try:
+        with METRICS.timer("gofile_upload"):
+            response = await loop.run_in_executor(None, lambda: GOFILE_CLIENT.content.post(upload_url, headers=headers, data=body))
+        response.raise_for_status()
+    except CancelledError:
+        # Stops the worker thread at its next read instead of letting it finish the upload
+        body.aborted = True; raise
+    except Exception:
+        GOFILE_CLIENT.invalidate("servers"); raise
     upload_result = response.json()
     if upload_result.get("status") != "ok": raise Exception(f"GoFile API error: {upload_result.get('data', {})}")
-    download_page = upload_result.get("data", {}).get("downloadPage")
-    await status_message.edit(f"🎉 **Upload successful!**\n\n{download_page}")
+    return upload_result.get("data", {}).get("downloadPage")
+
+async def upload_to_gofile(filepath, filename, status_message) -> str:
+    with open(filepath, 'rb') as f:
+        download_page = await stream_to_gofile(f, filename, os.path.getsize(filepath), status_message)
+    STATUS.finish(status_message, f"🎉 **Upload successful!**\n\n{download_page}")
+    return download_page
+
+async def answer_from_index(keys, status_message) -> str | None:
+    if not (download_page := await DEDUP_INDEX.find_valid(keys)): return None
+    STATUS.finish(status_message, f"🎉 **Upload successful!** (already on GoFile)\n\n{download_page}")
+    return download_page
+
+async def relay_to_gofile(source, filename, size, status_message, hasher=None) -> str:
+    """Pipes a source into a GoFile upload without touching the disk.
+
+    An async iterator of chunks is fed to the upload thread through a RingBuffer. A blocking
+    source with `readinto` is read by the upload thread itself, so a relay never needs a
+    second executor thread that a full pool could withhold while the first one waits for data.
+    """
+    producer = None
+    if not hasattr(source, "readinto"):
+        ring = RingBuffer(RELAY_BUFFER_SIZE, asyncio.get_running_loop())
+        async def produce(chunks):
+            try:
+                async for chunk in chunks: await ring.write(chunk)
+            except BaseException as e:
+                ring.close(e); raise
+            ring.close()
+        producer = asyncio.ensure_future(produce(source)); source = ring
+    try:
+        STATUS.set(status_message, f"📡 Relaying `{filename}` to GoFile...")
+        download_page = await stream_to_gofile(source, filename, size, status_message, action="Relaying to GoFile", hasher=hasher)
+    finally:
+        if producer: producer.cancel()
+    STATUS.finish(status_message, f"🎉 **Upload successful!**\n\n{download_page}")
+    return download_page
+
+class ResponseReader:
+    """Blocking `readinto` over the undecoded body of a streamed requests response."""
+    def __init__(self, response):
+        self.raw = response.raw
+
+    def readinto(self, buffer) -> int:
+        read = self.raw.readinto(buffer)
+        METRICS.add_bytes("link_download", read)
+        return read
+
+async def relay_link_to_gofile(url, filename, status_message, keys) -> bool:
+    """Relays a link straight to GoFile; returns False when the source cannot be streamed.
+
+    The multipart body needs the length up front, so only responses with a Content-Length
+    and no content encoding (which requests would transparently inflate) are relayed.
+    """
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(None, lambda: requests.get(url, stream=True, timeout=30))
+    try:
+        response.raise_for_status()
+        size = int(response.headers.get('Content-Length') or 0)
+        if not size or response.headers.get('Content-Encoding'): return False
+        hasher = hashlib.sha256()
+        download_page = await relay_to_gofile(ResponseReader(response), filename, size, status_message, hasher=hasher)
+        await loop.run_in_executor(None, DEDUP_INDEX.remember, keys + [content_key(hasher)], download_page)
+        return True
+    finally:
+        response.close()
+
+METRICS.collector("user_tasks", "gauge", "Unfinished jobs per user in USER_TASKS, queued ones included",
+                  lambda: {user_id: sum(not task.done() for task in list(tasks)) for user_id, tasks in list(USER_TASKS.items())}, label="user")
+METRICS.collector("jobs", "gauge", "Scheduled jobs by state",
+                  lambda: {"running": sum(SCHEDULER.running.values()), "queued": sum(len(jobs) for jobs in list(SCHEDULER.waiting.values()))}, label="state")
+METRICS.collector("reserved_disk_bytes", "gauge", "Disk space reserved by running jobs", lambda: SCHEDULER.reserved_bytes)
+METRICS.collector("queue_depth", "gauge", "Items waiting between stages, summed over running jobs",
+                  lambda: {"pipeline_probe": sum(p.probe_queue.qsize() for p in list(PIPELINES)),
+                           "pipeline_upload": sum(p.upload_queue.qsize() for p in list(PIPELINES)),
+                           "status_edits": len(STATUS._pending)}, label="queue")
+METRICS.collector("executor_threads", "gauge", "Default executor calls by state, and its size",
+                  lambda: {"active": EXECUTOR.active, "queued": EXECUTOR.queued, "max": EXECUTOR._max_workers}, label="state")
+METRICS.collector("event_loop_lag_seconds_last", "gauge", "Most recent event-loop lag sample", lambda: round(LOOP_MONITOR.lag, 6))
+METRICS.collector("gofile_session_cache_total", "counter", "GoFile token/wt/server cache lookups",
+                  lambda: {f"{key}_{result}": count for key, stats in GOFILE_CLIENT.stats.items() for result, count in stats.items()}, label="entry")
+METRICS.collector("status_updates_total", "counter", "Status-message updater outcomes", lambda: dict(STATUS.stats), label="outcome")
+METRICS.collector("media_probes_total", "counter", "Media inspection ffmpeg runs and cache hits", lambda: dict(MEDIA_PROBER.stats), label="outcome")
 
 async def main():
     if not all([API_ID, API_HASH, GOFILE_TOKEN]):
         logger.critical("FATAL: One or more environment variables (API_ID, API_HASH, GOFILE_TOKEN) are not set.")
         return
+    asyncio.get_running_loop().set_default_executor(EXECUTOR)
+    LOOP_MONITOR.start()
+    if METRICS_PORT: start_metrics_server()
     await client.start()
     logger.info("Master GoFile Bot has started successfully.")
+    await resume_unfinished_jobs()
     await client.run_until_disconnected()
 
 if __name__ == '__main__':